@@ -0,0 +1,142 @@
+''' time the main analysis stages on synthetic data, and compare to baselines
+
+Run from the repository root, e.g.
+
+    python -m benchmarks.run --sites 10000 1000000
+    python -m benchmarks.run --sites 10000 1000000 --save-baseline
+'''
+
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+import numpy
+
+from weights.enrichment import site_observed, binned_enrichment
+from weights.site_keys import site_keys, merge_on_keys
+from weights.constraint import get_constrained_regions, get_constrained_positions, \
+    ConstrainedRegions
+
+from benchmarks.synthetic import synthetic_rates, synthetic_cadd, \
+    synthetic_de_novos, synthetic_constraint
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+def get_options():
+    parser = argparse.ArgumentParser(description='benchmark analysis stages ' \
+        'on synthetic data')
+    parser.add_argument('--sites', type=int, nargs='+', default=[10000, 1000000],
+        help='numbers of sites to benchmark at')
+    parser.add_argument('--de-novos', type=int, default=5000,
+        help='number of synthetic de novos')
+    parser.add_argument('--repeats', type=int, default=3,
+        help='number of runs per stage, the fastest run is reported')
+    parser.add_argument('--baseline', default=BASELINE_PATH,
+        help='path to JSON file of baseline results')
+    parser.add_argument('--save-baseline', default=False, action='store_true',
+        help='record these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+        help='flag stages slower than this multiple of the baseline')
+    parser.add_argument('--output', help='path to write results to, as JSON')
+    
+    return parser.parse_args()
+
+def measure(func, repeats=3):
+    ''' time a function, and find the peak memory it allocates
+    
+    Returns:
+        tuple of (fastest wall time in seconds, peak allocated MB, result)
+    '''
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    
+    # measure memory in a separate run, as tracing slows the run down
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    return min(times), peak / 1e6, result
+
+def stages(n_sites, n_de_novos):
+    ''' set up the synthetic data, and get the benchmark stages for a size
+    
+    Returns:
+        list of (stage name, function) tuples
+    '''
+    rates = synthetic_rates(n_sites)
+    cadd = synthetic_cadd(rates)
+    de_novos = synthetic_de_novos(rates, cadd, n_de_novos)
+    constraint, transcripts = synthetic_constraint(rates)
+    
+    rates['key'] = site_keys(rates['chrom'], rates['pos'], rates['ref'], rates['alt'])
+    cadd['key'] = site_keys(cadd['chrom'], cadd['pos'], cadd['ref'], cadd['alt'])
+    de_novos['key'] = site_keys(de_novos['chrom'], de_novos['start_pos'],
+        de_novos['ref_allele'], de_novos['alt_allele'])
+    
+    merged = merge_on_keys(rates, cadd)
+    observed = site_observed(merged, de_novos)
+    edges = numpy.arange(0, 60.1, 0.1)
+    
+    groups = [ (transcripts[x.split('.')[0]], g) for x, g in constraint.groupby('transcript') ]
+    regions = ConstrainedRegions()
+    for tx, group in groups:
+        regions.add_transcript(tx, group, 1e-3, 0.6)
+    
+    return [
+        ('site_keys', lambda: site_keys(rates['chrom'], rates['pos'], rates['ref'], rates['alt'])),
+        ('merge_pandas', lambda: rates.merge(cadd, how='left', on=['chrom', 'pos', 'ref', 'alt'])),
+        ('merge_keys', lambda: merge_on_keys(rates, cadd)),
+        ('site_observed', lambda: site_observed(merged, de_novos)),
+        ('binned_enrichment', lambda: binned_enrichment(merged['score'],
+            merged['prob'], observed, edges)),
+        ('constrained_regions', lambda: [ get_constrained_regions(tx, g, 1e-3, 0.6)
+            for tx, g in groups ]),
+        ('constrained_positions', lambda: [ get_constrained_positions(tx, g, 1e-3, 0.6)
+            for tx, g in groups ]),
+        ('constrained_lookup', lambda: ConstrainedRegions.contains(regions,
+            merged['chrom'], merged['pos'])),
+        ]
+
+def main():
+    args = get_options()
+    
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+    
+    results = {}
+    print('{:<24}{:>12}{:>12}{:>12}{:>12}'.format('stage', 'sites', 'seconds',
+        'peak MB', 'vs base'))
+    for n_sites in args.sites:
+        for name, func in stages(n_sites, args.de_novos):
+            seconds, peak, _ = measure(func, args.repeats)
+            key = '{}:{}'.format(name, n_sites)
+            results[key] = {'seconds': seconds, 'peak_mb': peak}
+            
+            change, flag = '', ''
+            if key in baseline:
+                ratio = seconds / baseline[key]['seconds']
+                change = '{:.2f}x'.format(ratio)
+                flag = '  SLOWER' if ratio > args.tolerance else ''
+            
+            print('{:<24}{:>12}{:>12.4f}{:>12.1f}{:>12}{}'.format(name, n_sites,
+                seconds, peak, change, flag))
+    
+    if args.output is not None:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=2, sort_keys=True)
+    
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as handle:
+            json.dump(baseline, handle, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+''' generate synthetic rates, CADD, de novo and regional constraint tables, so
+benchmarks can run offline at any size.
+'''
+
+import numpy
+import pandas
+
+BASES = numpy.array(['A', 'C', 'G', 'T'])
+CQS = numpy.array(['missense', 'synonymous', 'nonsense', 'splice_lof', 'splice_region'])
+CQ_FREQS = [0.7, 0.24, 0.04, 0.01, 0.01]
+CHROMS = [ str(x) for x in range(1, 23) ] + ['X']
+
+class SyntheticTranscript(object):
+    ''' minimal stand-in for a denovonear Transcript, for coding coordinates
+    
+    The transcript is on the + strand, with CDS exons of fixed length
+    separated by fixed length introns.
+    '''
+    
+    def __init__(self, chrom, start, exons, exon_length=150, intron_length=1000):
+        self.chrom = chrom
+        step = exon_length + intron_length
+        self.cds = [ (start + i * step, start + i * step + exon_length - 1)
+            for i in range(exons) ]
+        self.exon_length = exon_length
+    
+    def get_chrom(self):
+        return self.chrom
+    
+    def get_strand(self):
+        return '+'
+    
+    def get_cds(self):
+        return [ {'start': start, 'end': end} for start, end in self.cds ]
+    
+    def get_position_on_chrom(self, pos, offset=0):
+        exon = min(pos // self.exon_length, len(self.cds) - 1)
+        return self.cds[exon][0] + pos - exon * self.exon_length + offset
+    
+    def in_coding_region(self, pos):
+        return any( start <= pos <= end for start, end in self.cds )
+
+def synthetic_rates(n_sites, sites_per_gene=4500, seed=0):
+    ''' make a table of per-site rates, with three alts at each position
+    
+    Genes are made of 150 bp exons separated by 1 kb introns, and are laid out
+    along chromosomes in turn.
+    '''
+    rng = numpy.random.default_rng(seed)
+    n_pos = max(1, n_sites // 3)
+    
+    gene = numpy.arange(n_pos) // (sites_per_gene // 3)
+    within = numpy.arange(n_pos) % (sites_per_gene // 3)
+    pos = 1000000 + (gene // len(CHROMS)) * 2000000 + (within // 150) * 1150 + within % 150
+    chrom = numpy.array(CHROMS)[gene % len(CHROMS)]
+    
+    ref = rng.integers(0, 4, n_pos)
+    alts = (ref[:, None] + numpy.arange(1, 4)[None, :]) % 4
+    
+    rates = pandas.DataFrame({
+        'symbol': numpy.repeat(numpy.char.add('GENE', gene.astype(str)), 3),
+        'chrom': numpy.repeat(chrom, 3),
+        'pos': numpy.repeat(pos, 3),
+        'ref': numpy.repeat(BASES[ref], 3),
+        'alt': BASES[alts.ravel()],
+        'cq': rng.choice(CQS, size=n_pos * 3, p=CQ_FREQS),
+        'prob': rng.lognormal(numpy.log(1e-8), 1.0, n_pos * 3)},
+        columns=['symbol', 'chrom', 'pos', 'ref', 'alt', 'cq', 'prob'])
+    
+    return rates
+
+def synthetic_cadd(rates, seed=0):
+    ''' make CADD raw and scaled scores for every site in a rates table
+    '''
+    rng = numpy.random.default_rng(seed + 1)
+    score = rng.gamma(2.0, 6.0, len(rates)).clip(0, 60)
+    
+    cadd = rates[['chrom', 'pos', 'ref', 'alt']].copy()
+    cadd['raw'] = score / 10 - 1
+    cadd['score'] = score
+    
+    return cadd
+
+def synthetic_de_novos(rates, cadd, n_de_novos, seed=0):
+    ''' draw de novos from sites, weighted by rate and more so at high CADD
+    '''
+    rng = numpy.random.default_rng(seed + 2)
+    weights = rates['prob'].values * numpy.where(cadd['score'].values > 25, 10, 1)
+    rows = rng.choice(len(rates), size=n_de_novos, p=weights / weights.sum())
+    sites = rates.iloc[rows]
+    
+    return pandas.DataFrame({'person_id': numpy.char.add('P', numpy.arange(n_de_novos).astype(str)),
+        'chrom': sites['chrom'].values, 'start_pos': sites['pos'].values,
+        'end_pos': sites['pos'].values, 'ref_allele': sites['ref'].values,
+        'alt_allele': sites['alt'].values, 'hgnc': sites['symbol'].values,
+        'consequence': sites['cq'].values, 'type': 'snv'})
+
+def synthetic_constraint(rates, regions_per_gene=3, seed=0):
+    ''' split each gene's protein into regions, with random constraint metrics
+    
+    Returns:
+        tuple of (constraint DataFrame, dictionary of SyntheticTranscript
+        objects indexed by transcript ID)
+    '''
+    rng = numpy.random.default_rng(seed + 3)
+    genes = rates.groupby('symbol', sort=False).agg({'chrom': 'first', 'pos': ['min', 'max']})
+    genes.columns = ['chrom', 'start', 'end']
+    
+    rows, transcripts = [], {}
+    for symbol, gene in genes.iterrows():
+        tx_id = 'ENST{}.1'.format(symbol[4:].zfill(11))
+        exons = (gene['end'] - gene['start']) // 1150 + 1
+        transcripts[tx_id.split('.')[0]] = SyntheticTranscript(gene['chrom'], gene['start'], exons)
+        
+        length = exons * 150 // 3
+        bounds = numpy.linspace(1, length, regions_per_gene + 1).astype(int)
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            rows.append({'gene': symbol, 'transcript': tx_id, 'chr': gene['chrom'],
+                'amino_acids': '{}-{}'.format(start, end - 1),
+                'chisq_diff_null': rng.exponential(10), 'obs_exp': rng.uniform(0, 1.2)})
+    
+    return pandas.DataFrame(rows), transcripts
@@ -1,124 +1,459 @@
 
 
+''' check the enrichment of missense de novos in bins of CADD scores, for all
+sites in dominant genes, and for sites in and out of regional constraint.
+
+Stages (load, expected rates, merge, annotate, bin and plot) are cached on disk
+by their inputs and parameters, so a rerun only recomputes stages downstream of
+whatever changed.
+'''
+
+import argparse
+import copy
 import os
-from itertools import accumulate
 
+import numpy
 import pandas
 
-from denovonear.ensembl_requester import EnsemblRequest
-from denovonear.load_gene import construct_gene_object
-from denovonear.load_mutation_rates import load_mutation_rates
-from denovonear.site_specific_rates import SiteRates
-
 from mupit.constants import LOF_CQ, MISSENSE_CQ
 
 from weights.load_data import load_rates, load_cadd, count_trios, load_de_novos, \
-    load_regional_constraint
-from weights.chrX_correction import correct_for_x_chrom
-from weights.plot_enrichment import plot_enrichment
-from weights.constraint import get_constrained_positions
+    load_regional_constraint, iter_sites, is_stored
+from weights.chrX_correction import expected_rate_matrix
+from weights.plot_enrichment import render_batch
+from weights.constraint import get_transcript_regions, index_regions
+from weights.enrichment import site_observed, binned_enrichment, \
+    binned_enrichment_matrix, quantile_edges
+from weights.site_keys import merge_on_keys, merge_join
+from weights.resampling import resample_enrichment
+from weights.bin_search import threshold_for_enrichment, optimal_edges, \
+    binned_curves
+from weights.incremental import build_artifact, update_observed, artifact_binned, \
+    artifact_curves, save_artifact, load_artifact
+from weights.pipeline import StageCache, file_key
 
-rates_path = '/nfs/users/nfs_j/jm33/apps/mutation_weights/dominant_rates.txt.gz'
-cadd_path = '/nfs/users/nfs_j/jm33/apps/mutation_weights/cadd_scores-1.3.txt.gz'
-cache_dir = '/nfs/users/nfs_j/jm33/apps/denovonear/scripts/cache'
-de_novos_path = '/lustre/scratch113/projects/ddd/users/jm33/de_novos.ddd_4k.ddd_only.2015-11-24.txt'
-validations_path = '/lustre/scratch113/projects/ddd/users/jm33/de_novos.validation_results.2015-11-24.txt'
-trios_path = '/nfs/ddd0/Data/datafreeze/ddd_data_releases/2015-04-13/trios.txt'
-families_path = '/nfs/ddd0/Data/datafreeze/ddd_data_releases/2015-04-13/family_relationships.txt'
+RATES_PATH = '/nfs/users/nfs_j/jm33/apps/mutation_weights/dominant_rates.txt.gz'
+CADD_PATH = '/nfs/users/nfs_j/jm33/apps/mutation_weights/cadd_scores-1.3.txt.gz'
+ENSEMBL_DIR = '/nfs/users/nfs_j/jm33/apps/denovonear/scripts/cache'
+DE_NOVOS_PATH = '/lustre/scratch113/projects/ddd/users/jm33/de_novos.ddd_4k.ddd_only.2015-11-24.txt'
+VALIDATIONS_PATH = '/lustre/scratch113/projects/ddd/users/jm33/de_novos.validation_results.2015-11-24.txt'
+TRIOS_PATH = '/nfs/ddd0/Data/datafreeze/ddd_data_releases/2015-04-13/trios.txt'
+FAMILIES_PATH = '/nfs/ddd0/Data/datafreeze/ddd_data_releases/2015-04-13/family_relationships.txt'
 
-constraint_path = '/nfs/users/nfs_j/jm33/apps/mutation_weights/genes_regional_data_cleaned_chisq_0.0_metrics_2016_10_05.txt.gz'
+CONSTRAINT_PATH = '/nfs/users/nfs_j/jm33/apps/mutation_weights/genes_regional_data_cleaned_chisq_0.0_metrics_2016_10_05.txt.gz'
+
+def get_options():
+    
+    parser = argparse.ArgumentParser(description='check enrichment of ' \
+        'missense de novos in bins of CADD scores')
+    parser.add_argument('--rates', default=RATES_PATH,
+        help='path to per-site mutation rates (table, store or shards)')
+    parser.add_argument('--cadd', default=CADD_PATH,
+        help='path to per-site CADD scores (table, store or shards)')
+    parser.add_argument('--de-novos', default=DE_NOVOS_PATH,
+        help='path to table of de novos')
+    parser.add_argument('--validations', default=VALIDATIONS_PATH,
+        help='path to table of de novo validation results')
+    parser.add_argument('--trios', default=TRIOS_PATH,
+        help='path to table of trios')
+    parser.add_argument('--families', default=FAMILIES_PATH,
+        help='path to table of family relationships')
+    parser.add_argument('--constraint', default=CONSTRAINT_PATH,
+        help='path to table of regional missense constraint')
+    parser.add_argument('--ensembl-cache', default=ENSEMBL_DIR,
+        help='path to Ensembl cache folder')
+    parser.add_argument('--threshold', type=float, default=1e-3,
+        help='maximum p-value for a region to count as constrained')
+    parser.add_argument('--ratio', type=float, default=0.4,
+        help='maximum obs/exp ratio for a region to count as constrained')
+    parser.add_argument('--increment', type=float, default=5,
+        help='width of CADD bins')
+    parser.add_argument('--max-score', type=float, default=40,
+        help='upper edge of the highest CADD bin')
+    parser.add_argument('--scores', nargs='+', default=['score'],
+        help='score columns to compare enrichment across, e.g. score raw. ' \
+            'The score column uses the CADD bins, others use quantile bins.')
+    parser.add_argument('--replicates', type=int, default=10000,
+        help='number of bootstrap and permutation replicates per stratum')
+    parser.add_argument('--processes', type=int, default=4,
+        help='number of processes for resampling')
+    parser.add_argument('--float32', default=False, action='store_true',
+        help='hold rates and scores as float32, to halve their memory use')
+    parser.add_argument('--artifact',
+        help='path to binned expected rates and observed de novos, saved by ' \
+            'an earlier run. Counts are updated for de novos which differ from ' \
+            'that run, and the file is then updated for this run.')
+    parser.add_argument('--chunksize', type=int,
+        help='stream rates and CADD scores in chunks of this many sites, ' \
+            'merge-joining them by position, rather than loading whole ' \
+            'tables. Both must be sorted by chromosome and position. Not ' \
+            'available with --artifact, --scores or --float32.')
+    parser.add_argument('--output-prefix', default='weights.v1.3',
+        help='prefix for plot paths, as PREFIX.STRATUM.pdf')
+    parser.add_argument('--stage-cache', default=StageCache().folder,
+        help='folder to cache stage outputs in')
+    parser.add_argument('--no-cache', default=False, action='store_true',
+        help='recompute every stage, without reading or writing the cache')
+    
+    args = parser.parse_args()
+    
+    # streamed runs only keep binned totals, not the per-site tables which the
+    # artifact and quantile bins need, and hold a chunk of sites at a time
+    if args.chunksize is not None:
+        unsupported = [ name for name, used in [('--artifact', args.artifact is not None),
+            ('--scores', args.scores != ['score']), ('--float32', args.float32)] if used ]
+        if len(unsupported) > 0:
+            parser.error('{} cannot be used with --chunksize'.format(', '.join(unsupported)))
+    
+    return args
 
 def get_expected_rates(rates, male, female):
+    ''' get expected de novo counts per site, without changing the rates table
+    '''
     
-    autosomal = 2 * (male + female)
-    rates['prob'] = rates['prob'] * autosomal
+    cohort = {'cohort': {'male': male, 'female': female}}
+    expected = expected_rate_matrix(rates, cohort)
     
-    return correct_for_x_chrom(rates, male, female)
+    return rates.assign(prob=expected['cohort'].astype(rates['prob'].dtype))
 
 def merge_rates_and_cadd(rates, cadd):
-    return rates.merge(cadd, how='left', on=['chrom', 'pos', 'ref', 'alt'])
+    return merge_on_keys(rates, cadd)
+
+def count_ptvs(symbols, de_novos):
+    ''' count the PTV de novos within a set of genes
+    '''
+    ptv = de_novos[de_novos['hgnc'].isin(symbols) & de_novos['consequence'].isin(LOF_CQ)]
+    
+    return len(ptv)
+
+def get_ptv_enrichment(expected, de_novos):
+    ''' check the enrichment of PTV candidates within the PTV sites
+    '''
+    dominant = set(expected['symbol'])
+    
+    return count_ptvs(dominant, de_novos)/sum(expected['prob'][expected.cq.isin(['nonsense', 'splice_lof'])])
 
 def check_enrichment(missense, de_novos, min_threshold, max_threshold=None):
     ''' check enrichment of missense de novos within sites
     '''
     
-    # select missense sites with CADD scores > threshold
-    subset = missense[(missense['score'] >= min_threshold)]
-    if max_threshold is not None:
-        subset = subset[subset['score'] < max_threshold]
-    
-    expected = sum(subset['prob'])
-    keys = set(zip(subset['chrom'], subset['pos'], subset['alt']))
+    if max_threshold is None:
+        max_threshold = float('inf')
     
-    # count the observed missense SNVs within those sites
-    de_novo_keys = set(zip(de_novos['chrom'], de_novos['start_pos'], de_novos['alt_allele']))
-    observed = len(de_novo_keys & keys)
+    observed = missense['observed'] if 'observed' in missense else \
+        site_observed(missense, de_novos)
+    binned = binned_enrichment(missense['score'], missense['prob'], observed,
+        [min_threshold, max_threshold])
     
     # return the ratio of observed to expected
-    return observed/expected, len(subset)
+    return binned['ratio'][0], binned['sites'][0]
 
-def annotate_constraint(data, constraint_path, threshold=1e-3, ratio=0.4):
+def annotate_constraint(data, constraint_path, threshold=1e-3, ratio=0.4,
+        ensembl_dir=ENSEMBL_DIR):
     ''' annotate per-site rates by whether the site is under regional constraint
     '''
-    # default to unconstrained
-    data['constrained'] = False
     
     constraint = load_regional_constraint(constraint_path)
-    mut_dict = load_mutation_rates()
-    ensembl = EnsemblRequest(cache_dir, 'grch37')
+    transcripts = constraint['transcript'][constraint['gene'].isin(data['symbol'])]
     
-    modified = []
-    for symbol, group in data.groupby('symbol'):
-        if symbol not in set(constraint['gene']):
-            sites = set([])
-        else:
-            regional = constraint[constraint['gene'] == symbol]
-            tx_id = list(regional['transcript'])[0]
-            tx = construct_gene_object(ensembl, tx_id.split('.')[0])
-            sites = get_constrained_positions(tx, regional, threshold, ratio)
-        
-        gene_constraint = group['constrained'].copy()
-        gene_constraint.loc[group['pos'].isin(sites)] = True
-        group['constrained'] = gene_constraint
-        
-        modified.append(group)
+    regions = get_transcript_regions(constraint, ensembl_dir, threshold, ratio,
+        transcripts=transcripts)
+    regions = index_regions(regions)
+    
+    data['constrained'] = regions.contains(data['chrom'], data['pos'])
     
-    return pandas.concat(modified)
+    return data
 
-rates = load_rates(rates_path)
-cadd = load_cadd(cadd_path)
+def index_sites(data, increment=5, max_score=40):
+    ''' get the expected side of the CADD bins, for all sites and per stratum
+    
+    This doesn't depend on the de novos, so is reused across de novo freezes.
+    
+    Returns:
+        dictionary from build_artifact, with strata for all missense sites,
+        and missense sites in and out of constrained regions
+    '''
+    
+    # select strata by masks, so the only copies are of the needed columns
+    is_missense = (data['cq'] == 'missense').values
+    constrained = data['constrained'].values
+    strata = {'all': is_missense, 'constrained': is_missense & constrained,
+        'unconstrained': is_missense & ~constrained}
+    
+    # get enrichment within CADD ranges (rather than in sites above a threshold)
+    edges = [ x * increment for x in range(int(round(max_score / increment)) + 1) ]
+    
+    return build_artifact(data['key'].values, data['score'].values,
+        data['prob'].values, strata, edges)
 
-trios = count_trios(trios_path, families_path)
-expected = get_expected_rates(rates, trios['male'], trios['female'])
+def observe_de_novos(index, index_key, de_novos, path=None):
+    ''' count observed de novos per bin, updating from a previous freeze
+    
+    If an artifact saved for an earlier de novo freeze (with the same expected
+    side) exists at the path, only the de novo sites which differ from that
+    freeze are counted. The updated artifact is then saved back to the path.
+    
+    Returns:
+        artifact with observed counts for the de novos
+    '''
+    
+    artifact = load_artifact(path)
+    if artifact is None or artifact.get('index_key') != index_key:
+        artifact = copy.deepcopy(index)
+        artifact['index_key'] = index_key
+    
+    added, removed = update_observed(artifact, de_novos['key'])
+    print('de novo sites added: {}, removed: {}'.format(added, removed))
+    
+    if path is not None:
+        save_artifact(artifact, path)
+    
+    return artifact
 
-data = merge_rates_and_cadd(expected, cadd)
-data = annotate_constraint(data, constraint_path)
+def summarise_stratum(binned, curves, lof_enrich, replicates=10000, processes=4):
+    ''' get the results for a stratum, from its binned counts and curves
+    
+    Returns:
+        dictionary with the binned enrichment (with confidence intervals and
+        permutation p-values), the CDF of sites across bins, the CADD
+        threshold where missense enrichment matches PTV enrichment, and the
+        bin edges which best separate the enrichment.
+    '''
+    
+    # bootstrap confidence intervals, and permutation p-values, per bin
+    resampled = resample_enrichment(binned['observed'], binned['expected'],
+        replicates=replicates, processes=processes)
+    binned = pandas.concat([binned, resampled], axis=1)
+    
+    # find the CADD threshold where missense enrichment matches PTVs, and
+    # the bin edges which best separate the missense enrichment
+    try:
+        best_edges = [ float(x) for x in optimal_edges(curves, n_bins=len(binned)) ]
+    except ValueError:
+        # too few expected de novos to fill every bin
+        best_edges = None
+    
+    return {'binned': binned,
+        'cdf': list(binned['sites'].cumsum() / binned['sites'].sum()),
+        'ptv_threshold': threshold_for_enrichment(curves, lof_enrich),
+        'optimal_edges': best_edges}
 
-constrained = data[data['constrained']]
-unconstrained = data[~data['constrained']]
+def bin_enrichment(artifact, lof_enrich, replicates=10000, processes=4):
+    ''' get enrichment in CADD bins, for all sites and per constraint stratum
+    
+    Returns:
+        dictionary of results per stratum, see summarise_stratum
+    '''
+    
+    return { key: summarise_stratum(artifact_binned(artifact, key),
+        artifact_curves(artifact, key), lof_enrich, replicates, processes)
+        for key in artifact['strata'] }
 
-dominant = set(rates['symbol'])
-de_novos = load_de_novos(de_novos_path, validations_path)
+def stream_bins(rates_path, cadd_path, de_novos, constraint_path, male, female,
+        threshold=1e-3, ratio=0.4, ensembl_dir=ENSEMBL_DIR, chunksize=1000000,
+        increment=5, max_score=40, resolution=0.01):
+    ''' count expected and observed per CADD bin, from chunks of joined sites
+    
+    Rates and CADD scores are merge-joined in chunks (both must be sorted by
+    chromosome and position, as in site stores), and each chunk's counts are
+    added to running totals, so memory depends on the chunk size rather than
+    the number of sites. Thresholds are found from fine bins (of width
+    resolution), rather than from individual sites.
+    
+    Returns:
+        dictionary with the binned counts and cumulative curves per stratum,
+        and the PTV enrichment
+    '''
+    
+    constraint = load_regional_constraint(constraint_path)
+    regions = index_regions(get_transcript_regions(constraint, ensembl_dir,
+        threshold, ratio))
+    
+    edges = {'coarse': [ x * increment for x in range(int(round(max_score / increment)) + 1) ],
+        'fine': numpy.append(numpy.arange(0, 100, resolution), numpy.inf)}
+    
+    totals, symbols, ptv_expected = {}, set(), 0.0
+    for chunk in merge_join(iter_sites(rates_path, chunksize), iter_sites(cadd_path, chunksize)):
+        # every site at a position is in the same chunk, so this matches the
+        # removal of duplicates in load_rates
+        chunk = chunk[~chunk[['chrom', 'pos', 'alt']].duplicated()]
+        chunk = get_expected_rates(chunk, male, female)
+        
+        symbols |= set(chunk['symbol'])
+        ptv_expected += chunk['prob'][chunk['cq'].isin(['nonsense', 'splice_lof'])].sum()
+        
+        observed = site_observed(chunk, de_novos)
+        expected = chunk['prob'].values
+        is_missense = (chunk['cq'] == 'missense').values
+        constrained = regions.contains(chunk['chrom'], chunk['pos'])
+        strata = {'all': is_missense, 'constrained': is_missense & constrained,
+            'unconstrained': is_missense & ~constrained}
+        
+        scores = pandas.DataFrame({'coarse': chunk['score'].values,
+            'fine': chunk['score'].values})
+        for key, rows in strata.items():
+            binned = binned_enrichment_matrix(scores[rows], expected[rows],
+                observed[rows], edges)
+            counts = binned[['observed', 'expected', 'sites']].values
+            if key in totals:
+                counts = counts + totals[key][['observed', 'expected', 'sites']].values
+            totals[key] = binned.assign(observed=counts[:, 0], expected=counts[:, 1],
+                sites=counts[:, 2].astype(int))
+    
+    streamed = {'strata': {}, 'lof_enrich': count_ptvs(symbols, de_novos) / ptv_expected}
+    for key, binned in totals.items():
+        coarse = binned[binned['name'] == 'coarse'].drop(columns='name').reset_index(drop=True)
+        fine = binned[binned['name'] == 'fine']
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            coarse['ratio'] = coarse['observed'] / coarse['expected']
+        
+        streamed['strata'][key] = {'binned': coarse, 'curves': binned_curves(
+            fine['start'].values, fine['expected'].values, fine['observed'].values)}
+    
+    return streamed
+
+def bin_streamed(streamed, replicates=10000, processes=4):
+    ''' get enrichment per stratum, from the output of stream_bins
+    '''
+    
+    return { key: summarise_stratum(x['binned'], x['curves'], streamed['lof_enrich'],
+        replicates, processes) for key, x in streamed['strata'].items() }
+
+def score_enrichment(data, de_novos, columns, increment=5, max_score=40):
+    ''' get missense enrichment in bins of several scores, in one pass
+    
+    The scaled CADD score column uses fixed width bins. Other score columns
+    (raw scores, other CADD versions or other predictors) are split into
+    the same number of bins, at quantiles of the missense sites.
+    
+    Returns:
+        DataFrame with a row per bin per score, see binned_enrichment_matrix
+    '''
+    observed = site_observed(data, de_novos)
+    missense = (data['cq'] == 'missense').values
+    scores = data.loc[missense, columns]
+    
+    n_bins = int(round(max_score / increment))
+    edges = {}
+    for column in columns:
+        if column == 'score':
+            edges[column] = [ x * increment for x in range(n_bins + 1) ]
+        else:
+            edges[column] = quantile_edges(scores[column], n_bins)
+    
+    return binned_enrichment_matrix(scores, data['prob'].values[missense],
+        observed[missense], edges)
 
-# check the enrichment of PTV candidates within the PTV sites
-ptv = de_novos[de_novos['hgnc'].isin(dominant) & de_novos['consequence'].isin(LOF_CQ)]
-lof_enrich = len(ptv)/sum(rates['prob'][rates.cq.isin(['nonsense', 'splice_lof'])])
+def plot_strata(results, prefix, processes=1):
+    ''' plot the enrichment per stratum, and return the plot paths
+    '''
+    table = []
+    for key in results:
+        binned = results[key]['binned']
+        table.append(pandas.DataFrame({'name': '{}.{}'.format(os.path.basename(prefix), key),
+            'threshold': binned['start'], 'enrichment': binned['ratio'],
+            'cdf': results[key]['cdf']}))
+    table = pandas.concat(table, ignore_index=True)
+    
+    folder = os.path.dirname(prefix) or '.'
+    return render_batch(table, folder, processes=processes)
 
-subsets = {'all': data, 'constrained': constrained, 'unconstrained': unconstrained}
+def run_in_memory(args, cache, trios, trios_key, de_novos, de_novos_key):
+    ''' run the stages on whole tables, and return the results and their key
+    
+    Stages are only loaded (or run) once something downstream needs their
+    output, so a cached final stage doesn't load the tables upstream of it.
+    '''
+    
+    # load, without saving tables from site stores, which load memory-mapped
+    rates = cache.stage('load_rates', load_rates, [args.rates],
+        deps=[file_key(args.rates)], params={'float32': args.float32},
+        save=not is_stored(args.rates))
+    cadd = cache.stage('load_cadd', load_cadd, [args.cadd],
+        deps=[file_key(args.cadd)], params={'float32': args.float32},
+        save=not is_stored(args.cadd))
+    
+    # expected rates, and merge with CADD scores
+    expected = cache.stage('expected_rates', get_expected_rates,
+        [rates, trios['male'], trios['female']], deps=[rates, trios_key])
+    data = cache.stage('merge', merge_rates_and_cadd, [expected, cadd],
+        deps=[expected, cadd])
+    
+    # annotate
+    annotated = cache.stage('annotate', annotate_constraint,
+        [data, args.constraint], deps=[data, file_key(args.constraint)],
+        params={'threshold': args.threshold, 'ratio': args.ratio,
+            'ensembl_dir': args.ensembl_cache},
+        counts=lambda x: {'constrained': int(x['constrained'].sum())})
+    
+    # bin expected rates, then count de novos, from the previous freeze if given
+    index = cache.stage('index', index_sites, [annotated], deps=[annotated],
+        params={'increment': args.increment, 'max_score': args.max_score})
+    artifact = cache.stage('observe', observe_de_novos,
+        [index, index.key, de_novos, args.artifact], deps=[index, de_novos_key],
+        save=False)
+    
+    lof_enrich = cache.stage('ptv_enrichment', get_ptv_enrichment,
+        [expected, de_novos], deps=[expected, de_novos_key])
+    results = cache.stage('bin', bin_enrichment, [artifact, lof_enrich],
+        deps=[index, de_novos_key],
+        params={'replicates': args.replicates, 'processes': args.processes},
+        outputs=[ x for x in [args.artifact] if x is not None ])
+    
+    # compare enrichment across several scores
+    if args.scores != ['score']:
+        scores, _ = cache.run('scores', score_enrichment, [data, de_novos],
+            deps=[data, de_novos_key], params={'columns': args.scores,
+                'increment': args.increment, 'max_score': args.max_score})
+        scores.to_csv('{}.scores.txt'.format(args.output_prefix), sep='\t',
+            index=False)
+        print(scores)
+    
+    return results.output, results.key
 
-for key in subsets:
-    subset = subsets[key]
-    missense = subset[subset['cq'] == 'missense'].copy()
+def run_streaming(args, cache, trios, trios_key, de_novos, de_novos_key):
+    ''' run the stages on chunks of merge-joined sites, and return the results
+    '''
     
-    # get enrichment within CADD ranges (rather than in sites above a threshold)
-    increment = 5
-    thresh = list(range(0, 40, increment))
-    enrich = [ check_enrichment(missense, de_novos, x, x + increment) for x in thresh ]
-    cdf = [ x[1] for x in enrich ]
-    cdf = [ x/sum(cdf) for x in accumulate(cdf) ]
-    enrich = [ x[0] for x in enrich ]
-    print(key)
-    print(thresh)
-    print(enrich)
-    print(cdf)
-    plot_enrichment(thresh, enrich, cdf, path='weights.v1.3.{}.pdf'.format(key))
+    streamed, stream_key = cache.run('stream', stream_bins,
+        [args.rates, args.cadd, de_novos, args.constraint, trios['male'], trios['female']],
+        deps=[file_key(args.rates), file_key(args.cadd), file_key(args.constraint),
+            trios_key, de_novos_key],
+        params={'threshold': args.threshold, 'ratio': args.ratio,
+            'ensembl_dir': args.ensembl_cache, 'chunksize': args.chunksize, 'increment': args.increment,
+            'max_score': args.max_score})
+    
+    return cache.run('bin', bin_streamed, [streamed], deps=[stream_key],
+        params={'replicates': args.replicates, 'processes': args.processes})
+
+def main():
+    args = get_options()
+    cache = StageCache(args.stage_cache, enabled=not args.no_cache)
+    
+    trios, trios_key = cache.run('count_trios', count_trios,
+        [args.trios, args.families], deps=[file_key(args.trios), file_key(args.families)])
+    de_novos, de_novos_key = cache.run('load_de_novos', load_de_novos,
+        [args.de_novos, args.validations],
+        deps=[file_key(args.de_novos), file_key(args.validations)])
+    
+    run = run_in_memory if args.chunksize is None else run_streaming
+    results, bin_key = run(args, cache, trios, trios_key, de_novos, de_novos_key)
+    
+    for key in results:
+        binned = results[key]['binned']
+        print(key)
+        print(list(binned['start']))
+        print(list(binned['ratio']))
+        print(results[key]['cdf'])
+        print(list(zip(binned['lower'], binned['upper'])))
+        print(list(binned['p_value']))
+        print(results[key]['ptv_threshold'])
+        print(results[key]['optimal_edges'])
+    
+    # plot, rerunning if the plots have since been removed
+    paths = [ '{}.{}.pdf'.format(args.output_prefix, x) for x in results ]
+    cache.run('plot', plot_strata, [results, args.output_prefix, args.processes],
+        deps=[bin_key, args.output_prefix], outputs=paths)
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,18 @@
 
 import argparse
 import gzip
-from itertools import groupby, count
+import io
+import os
+import shutil
+import tempfile
+from multiprocessing import Pool
 
+import numpy
 import pysam
 import pandas
 
+from weights.site_store import write_store, chrom_rank
+
 rates_path = '/nfs/users/nfs_j/jm33/apps/mutation_weights/dominant_rates.txt.gz'
 cadd_path = '/lustre/scratch115/projects/ddd/users/jm33/cadd/v1.0/whole_genome_SNVs.tsv.gz'
 outpath = '/nfs/users/nfs_j/jm33/apps/mutation_weights/cadd_scores-1.0.txt.gz'
@@ -18,20 +25,40 @@ def get_options():
         help='path to site specific rates per gene')
     parser.add_argument('--cadd', default=cadd_path,
         help='path to tabix indexed CADD scores for all possible SNVs (GRCh37)')
+    parser.add_argument('--extra-scores', action='append', default=[],
+        metavar='NAME=PATH', help='another tabix indexed score file in the ' \
+            'CADD layout (e.g. another CADD version), to extract in the same ' \
+            'sweep, as NAME_raw and NAME columns. Can be given more than once.')
     parser.add_argument('--output', default=outpath)
+    parser.add_argument('--max-gap', type=int, default=1000,
+        help='merge blocks of sites closer than this into a single query')
+    parser.add_argument('--processes', type=int, default=1,
+        help='number of chromosomes to extract scores for at once')
+    parser.add_argument('--store',
+        help='path to also write scores to, as a memory-mappable site store')
     
     return parser.parse_args()
 
+COLUMNS = ['chrom', 'pos', 'ref', 'alt', 'raw', 'score']
+DTYPES = {'chrom': str, 'pos': numpy.int64, 'ref': str, 'alt': str,
+    'raw': numpy.float64, 'score': numpy.float64}
+
+def parse_cadd(lines):
+    ''' parse lines of tabix output straight into typed columns
+    '''
+    
+    if len(lines) == 0:
+        return pandas.DataFrame({ x: pandas.Series(dtype=DTYPES[x]) for x in COLUMNS },
+            columns=COLUMNS)
+    
+    handle = io.StringIO('\n'.join(lines))
+    return pandas.read_table(handle, header=None, names=COLUMNS, dtype=DTYPES)
+
 def load_cadd(cadd, chrom, start, end):
     ''' load cadd scores for a region
     '''
-    def parse(line):
-        chrom, pos, ref, alt, raw, scaled = line.split('\t')
-        
-        return {'chrom': chrom, 'pos': int(pos), 'ref': ref, 'alt': alt,
-            'raw': float(raw), 'score': float(scaled)}
     
-    return pandas.DataFrame([ parse(x) for x in cadd.fetch(chrom, start, end) ])
+    return parse_cadd(list(cadd.fetch(chrom, start, end)))
 
 def load_rates(path):
     ''' get a DataFrame of mutation rates by site
@@ -42,35 +69,133 @@ def load_rates(path):
     
     return rates
 
-def as_range(g):
-    l = list(g)
-    return l[0], l[-1]
+def get_regions(positions, max_gap=1000):
+    ''' merge positions into regions, splitting where positions are far apart
+    
+    Args:
+        positions: array of positions on a chromosome
+        max_gap: split regions where consecutive positions are more than this
+            distance apart
+    
+    Returns:
+        list of (start, end) tuples for each region
+    '''
+    
+    positions = numpy.unique(positions)
+    if len(positions) == 0:
+        return []
+    
+    splits = numpy.where(numpy.diff(positions) > max_gap)[0]
+    starts = positions[numpy.concatenate([[0], splits + 1])]
+    ends = positions[numpy.concatenate([splits, [len(positions) - 1]])]
+    
+    return list(zip(starts, ends))
+
+def parse_extra_scores(extra):
+    ''' split NAME=PATH arguments into a list of (name, path) tuples
+    '''
+    scores = []
+    for value in extra:
+        name, path = value.split('=', 1)
+        scores.append((name, path))
+    
+    return scores
+
+def score_columns(extra):
+    ''' get the output columns, for CADD plus any extra score files
+    '''
+    columns = list(COLUMNS)
+    for name, _ in extra:
+        columns += ['{}_raw'.format(name), name]
+    
+    return columns
+
+def extract_chrom(args):
+    ''' extract CADD scores for the sites on a chromosome, to a temporary file
+    
+    Each worker opens its own tabix handles, and writes scores per region, so
+    memory is bounded by the largest merged region, rather than by the table.
+    Extra score files are read for each region in the same sweep, and joined
+    to the CADD scores as extra columns.
+    
+    Args:
+        args: tuple of (path to tabix-indexed CADD scores, list of (name,
+            path) tuples for extra score files, chromosome, array of
+            positions, maximum gap between positions within a region, folder
+            for temporary files)
+    
+    Returns:
+        path to gzipped table of scores for the chromosome, without a header
+    '''
+    
+    path, extra, chrom, positions, max_gap, tmpdir = args
+    positions = numpy.unique(positions)
+    cadd = pysam.TabixFile(path)
+    others = [ (name, pysam.TabixFile(x)) for name, x in extra ]
+    
+    output = os.path.join(tmpdir, 'cadd.{}.txt.gz'.format(chrom))
+    with gzip.open(output, 'wt') as handle:
+        for start, end in get_regions(positions, max_gap):
+            scores = load_cadd(cadd, chrom, start - 1, end)
+            
+            # merged regions span positions outside the requested sites. Only
+            # the requested positions within the region are checked, by
+            # bisection, rather than hashing every position on the chromosome
+            within = positions[numpy.searchsorted(positions, start, side='left'):
+                numpy.searchsorted(positions, end, side='right')]
+            scores = scores[scores['pos'].isin(within)]
+            
+            for name, tabix in others:
+                other = load_cadd(tabix, chrom, start - 1, end)
+                other = other.rename(columns={'raw': '{}_raw'.format(name), 'score': name})
+                scores = scores.merge(other.drop(columns='chrom'), how='left',
+                    on=['pos', 'ref', 'alt'])
+            
+            scores.to_csv(handle, sep='\t', index=False, header=False)
+    
+    return output
 
 def main():
     args = get_options()
     
     rates = load_rates(args.rates)
-    cadd = pysam.TabixFile(args.cadd)
-    
-    cadd_data = pandas.DataFrame(columns=['chrom', 'pos', 'ref', 'alt', 'raw', 'score'])
-    for symbol, group in rates.groupby('symbol'):
-        chrom = set(group['chrom'])
-        assert len(chrom) == 1
-        chrom = list(chrom)[0]
-        
-        print(symbol)
-        # split the gene into contiguous blocks of positions relating to each,
-        # exon, rather than loading cadd scores for all sites from gene start
-        # to end which is slower and more memory intensive
-        for _, g in groupby(sorted(set(group['pos'])), key=lambda n, c=count(): n-next(c)):
-            start, end = as_range(g)
-            temp = load_cadd(cadd, chrom, start-1, end)
-            cadd_data = cadd_data.append(temp, ignore_index=True)
-    
-    cadd_data['pos'] = cadd_data['pos'].astype(int)
-    
-    with gzip.open(args.output, 'wt') as handle:
-        cadd_data.to_csv(handle, sep='\t', index=False)
+    extra = parse_extra_scores(args.extra_scores)
+    columns = score_columns(extra)
+    
+    tmpdir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(args.output)))
+    # extract chromosomes in genomic order, so the output can be merge-joined
+    groups = dict(list(rates.groupby('chrom')))
+    chroms = [ x for _, x in sorted(zip(chrom_rank(list(groups)), groups)) ]
+    jobs = [ (args.cadd, extra, chrom, numpy.unique(groups[chrom]['pos']),
+        args.max_gap, tmpdir) for chrom in chroms ]
+    
+    if args.processes > 1:
+        pool = Pool(args.processes)
+        parts = pool.imap(extract_chrom, jobs)
+    else:
+        parts = map(extract_chrom, jobs)
+    
+    # concatenated gzip members read as a single file, so the per-chromosome
+    # files can be appended without decompressing them
+    try:
+        with gzip.open(args.output, 'wt') as handle:
+            handle.write('\t'.join(columns) + '\n')
+        with open(args.output, 'ab') as output:
+            for path in parts:
+                print(path)
+                with open(path, 'rb') as handle:
+                    shutil.copyfileobj(handle, output)
+                os.remove(path)
+    finally:
+        shutil.rmtree(tmpdir)
+        if args.processes > 1:
+            pool.terminate()
+    
+    if args.store is not None:
+        dtypes = dict(DTYPES)
+        dtypes.update({ x: numpy.float64 for x in columns[len(COLUMNS):] })
+        cadd = pandas.read_table(args.output, dtype=dtypes)
+        write_store(cadd, args.store)
 
 if __name__ == '__main__':
     main()
@@ -1,20 +1,29 @@
 ''' script to get context specific mutation rates per nucleotide (and alt
 allele) for genes known to be dominantly associated with developmental
-disorders.
+disorders, or for all protein-coding genes, split by chromosome.
 '''
 
 import gzip
 import argparse
 import os
+import re
+from collections import deque
+from multiprocessing import Pool
 
 import pandas
 
-from denovonear.ensembl_requester import EnsemblRequest
 from denovonear.load_mutation_rates import load_mutation_rates
-from denovonear.load_gene import get_transcript_ids, construct_gene_object
-from denovonear.site_specific_rates import SiteRates
+
+from weights.load_data import load_rates
+from weights.site_store import write_store, chrom_rank
+from weights.transcripts import get_store
+from weights.ensembl_fetch import ThrottledRequester, fetch_transcripts, \
+    prefetch_transcripts
+from weights.site_rates import get_site_rates, CQS
+from weights.coordinates import CoordinateMapper
 
 KNOWN_PATH = "https://www.ebi.ac.uk/gene2phenotype/downloads/DDG2P.csv.gz"
+PROTEIN_CODING_PATH = "ftp://ftp.ebi.ac.uk/pub/databases/genenames/new/tsv/locus_groups/protein-coding_gene.txt"
 
 def get_options():
     '''
@@ -26,6 +35,31 @@ def get_options():
         help='path or url to table of known genes')
     parser.add_argument('--output', default='dominant_rates.txt.gz',
         help='path write table of rates to')
+    parser.add_argument('--processes', type=int, default=1,
+        help='number of processes to compute gene rates with')
+    parser.add_argument('--checkpoint',
+        help='path to record finished genes in. If this exists, the run ' \
+            'resumes after the last finished gene.')
+    parser.add_argument('--store',
+        help='path to also write rates to, as a memory-mappable site store')
+    parser.add_argument('--exome', default=False, action='store_true',
+        help='get rates for all protein-coding genes, rather than dominant ' \
+            'DDG2P genes. Output is split into a file per chromosome, with ' \
+            'the chromosome inserted into the output (and store) paths, and ' \
+            'each chromosome resumes from its own checkpoint.')
+    parser.add_argument('--protein-coding', default=PROTEIN_CODING_PATH,
+        help='path or url to HGNC table of protein-coding genes')
+    parser.add_argument('--threads', type=int, default=4,
+        help='number of threads fetching transcripts from Ensembl')
+    parser.add_argument('--prefetch', type=int, default=8,
+        help='number of genes to fetch ahead of the gene being computed')
+    parser.add_argument('--requests-per-second', type=float, default=15,
+        help='maximum rate of Ensembl requests, across all threads')
+    parser.add_argument('--retries', type=int, default=5,
+        help='number of retries for failed or throttled Ensembl requests')
+    parser.add_argument('--ensembl-server',
+        help='Ensembl REST server to use instead of the default, e.g. a ' \
+            'local stub of recorded responses (see weights/ensembl_stub.py)')
     
     return parser.parse_args()
 
@@ -61,29 +95,55 @@ def load_dominant(url, include_possible=False):
     
     return set(data['gene symbol'])
 
-def get_transcripts(symbol, ensembl):
+def load_protein_coding(path):
+    ''' get the HGNC symbols and chromosomes for all protein-coding genes
+    
+    Args:
+        path: path or URL to the HGNC protein-coding gene table
+    
+    Returns:
+        DataFrame of HGNC symbols and chromosomes (from the cytogenetic
+        location), sorted by chromosome. Genes without a chromosome are placed
+        on 'unplaced'.
+    '''
+    
+    data = pandas.read_table(path, usecols=['symbol', 'location'], dtype=str)
+    
+    location = data['location'].fillna('')
+    chrom = location.str.extract(r'^(\d+|X|Y)', expand=False)
+    chrom[location.str.startswith('mitochondria')] = 'MT'
+    data['chrom'] = chrom.fillna('unplaced')
+    
+    data = data.assign(rank=chrom_rank(data['chrom']))
+    data = data.sort_values(['rank', 'chrom', 'symbol'])
+    
+    return data[['symbol', 'chrom']]
+
+def shard_path(path, chrom):
+    ''' insert a chromosome into a path, e.g. rates.txt.gz -> rates.chr1.txt.gz
+    '''
+    
+    if '{chrom}' in path:
+        return path.replace('{chrom}', str(chrom))
+    
+    base, ext = re.match(r'^(.*?)((\.[^./]+)*)$', path).groups()[:2]
+    return '{}.chr{}{}'.format(base, chrom, ext)
+
+def get_transcripts(symbol, store, executor=None):
     ''' get a list of Transcript objects for a gene
     
     Args:
         symbol: HGNC symbol for a gene
-        ensembl: EnsemblRequest object, to retrieve gene data with
+        store: TranscriptStore object, to retrieve gene data with
+        executor: ThreadPoolExecutor to fetch the transcripts concurrently
+            with, or None to fetch them one at a time
     
     Returns:
         list of Transcript objects (see denovonear), sorted by size (longest
         transcripts first)
     '''
     
-    transcript_ids = get_transcript_ids(ensembl, symbol)
-    
-    transcripts = []
-    for x in sorted(transcript_ids, key=transcript_ids.get, reverse=True):
-        try:
-            tx = construct_gene_object(ensembl, x)
-            transcripts.append(tx)
-        except ValueError:
-            continue
-    
-    return transcripts
+    return fetch_transcripts(symbol, store, executor)
 
 def rates_per_site(transcripts, mut_dict):
     ''' get table of mutation rates per site across all transcripts for a gene
@@ -92,76 +152,226 @@ def rates_per_site(transcripts, mut_dict):
         transcripts: list of Transcript objects for a single gene (sorted by
             size, longest first)
         mut_dict:
+    
+    Returns:
+        pandas DataFrame of sites, with chrom, pos, ref, alt, cq and prob columns
     '''
     
     rates = []
     combined = None
     for tx in transcripts:
-        sites = SiteRates(tx, mut_dict, masked_sites=combined)
+        sites = get_site_rates(tx, mut_dict, masked_sites=combined)
         if combined is None:
             combined = tx
         combined += tx
         
         # for each consequence type, get all the sites for that consequence type,
         # along with the ref, alt and coordinates
-        for cq in ['nonsense', 'missense', 'synonymous', 'splice_lof', 'splice_region']:
-            for choice in sites[cq]:
-                choice['pos'] = tx.get_position_on_chrom(choice['pos'], choice['offset'])
-                choice['chrom'] = tx.get_chrom()
-                choice['cq'] = cq
-                rates.append(choice)
-    
-    return rates
+        mapper = CoordinateMapper.from_transcript(tx)
+        for cq in CQS:
+            if len(sites[cq]) == 0:
+                continue
+            
+            choices = pandas.DataFrame(sites[cq])
+            choices['pos'] = mapper.to_chrom(choices['pos'], choices['offset'])
+            choices['chrom'] = tx.get_chrom()
+            choices['cq'] = cq
+            rates.append(choices)
+    
+    if len(rates) == 0:
+        return pandas.DataFrame(columns=['chrom', 'pos', 'ref', 'alt', 'cq', 'prob'])
+    
+    return pandas.concat(rates, ignore_index=True)
 
-def get_gene_rates(symbol, ensembl, mut_dict):
+def get_gene_rates(symbol, store, mut_dict, transcripts=None):
     ''' get per nucleotide mutation rates for all SNV alt alleles in a gene
     
     Args:
         symbol: HGNC symbol for gene
-        ensembl: EnsemblRequest object, for extracting coordinates and sequence.
+        store: TranscriptStore object, for extracting coordinates and sequence.
         mut_dict: list of lists of sequence context changes and associated
             mutation rates as [[initial, changed, rate], ...]
+        transcripts: list of Transcript objects for the gene, if already
+            fetched, otherwise they are fetched from the store
     
     Returns:
         pandas DataFrame of mutation rates at each possible SNV change within
         the coding sequence of a gene.
     '''
     
-    transcripts = get_transcripts(symbol, ensembl)
+    if transcripts is None:
+        transcripts = get_transcripts(symbol, store)
     
     if len(transcripts) == 0:
         return pandas.DataFrame(columns=['symbol', 'chrom', 'pos', 'ref', 'alt',
             'cq', 'prob'])
     
     rates = rates_per_site(transcripts, mut_dict)
-    
-    # convert the list of dictionaries to a DataFrame, and track the gene
-    rates = pandas.DataFrame(rates)
     rates['symbol'] = symbol
     
     rates.sort_values(by=['pos', 'alt'], inplace=True)
     
     return rates[['symbol', 'chrom', 'pos', 'ref', 'alt', 'cq', 'prob']]
 
+def _init_worker(cache_dir, build, requester=None):
+    ''' set up the per-process transcript store and mutation rate objects
+    '''
+    global _store, _mut_dict
+    _store = get_store(cache_dir, build, requester=requester)
+    _mut_dict = load_mutation_rates()
+
+def _gene_rates(symbol):
+    return symbol, get_gene_rates(symbol, _store, _mut_dict)
+
+def run_windowed(pool, func, items, window):
+    ''' run a function on each item on a process pool, yielding results in order
+    
+    Unlike Pool.imap, which takes items as fast as it can, at most window
+    items are submitted but not yet returned, so a lazy source of items (such
+    as the transcript prefetcher) is only read ahead by that many.
+    '''
+    pending = deque()
+    for item in items:
+        pending.append(pool.apply_async(func, (item, )))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    
+    while len(pending) > 0:
+        yield pending.popleft().get()
+
+def load_checkpoint(path):
+    ''' load the genes finished in a previous run
+    
+    Args:
+        path: path to checkpoint file, with a line per finished gene, giving
+            the HGNC symbol and the size of the output file once the gene had
+            been written.
+    
+    Returns:
+        tuple of (set of finished HGNC symbols, output size after the last
+        finished gene)
+    '''
+    
+    finished, offset = set(), 0
+    if path is None or not os.path.exists(path):
+        return finished, offset
+    
+    with open(path) as handle:
+        for line in handle:
+            symbol, size = line.strip().split('\t')
+            finished.add(symbol)
+            offset = int(size)
+    
+    return finished, offset
+
+def write_gene(path, rates, header=False):
+    ''' append the rates for a gene to the output, as a complete gzip member
+    
+    Concatenated gzip members read back as a single file, and closing the
+    handle per gene means an interrupted run leaves at most one partial
+    member at the end of the file.
+    
+    Returns:
+        size of the output file after the gene has been written
+    '''
+    
+    with gzip.open(path, 'at') as handle:
+        rates.to_csv(handle, sep='\t', index=False, header=header)
+    
+    return os.path.getsize(path)
+
+def stream_rates(symbols, output, checkpoint=None, processes=1,
+        cache_dir='cache', build='grch37', requester=None, threads=4, prefetch=8):
+    ''' compute rates per gene, and write each gene to the output in order
+    
+    Transcripts are fetched on a thread pool, a few genes ahead of the genes
+    being computed. With many processes, the fetched transcripts are cached
+    on disk by the time a worker process needs them.
+    
+    Args:
+        symbols: list of HGNC symbols
+        output: path to write gzipped table of rates to
+        checkpoint: path to record finished genes in, or None
+        processes: number of processes to compute gene rates with
+        cache_dir: path to Ensembl cache folder
+        build: genome build for Ensembl requests
+        requester: function to make EnsemblRequest objects, see
+            weights.ensembl_fetch.ThrottledRequester
+        threads: number of threads fetching transcripts
+        prefetch: number of genes to fetch ahead
+    '''
+    
+    finished, offset = load_checkpoint(checkpoint)
+    
+    # if the output no longer holds the finished genes (e.g. it was removed),
+    # the checkpoint is stale, so start over rather than resume
+    size = os.path.getsize(output) if os.path.exists(output) else 0
+    if size < offset:
+        print('output is shorter than the checkpoint, starting over')
+        os.remove(checkpoint)
+        finished, offset = set(), 0
+    
+    symbols = [ x for x in symbols if x not in finished ]
+    
+    # drop anything written after the last finished gene, e.g. a partially
+    # written gene from an interrupted run
+    mode = 'r+b' if os.path.exists(output) else 'wb'
+    with open(output, mode) as handle:
+        handle.truncate(offset)
+    
+    store = get_store(cache_dir, build, requester=requester)
+    fetched = prefetch_transcripts(symbols, store, threads, prefetch)
+    
+    initargs = (cache_dir, build, requester)
+    if processes > 1:
+        pool = Pool(processes, initializer=_init_worker, initargs=initargs)
+        results = run_windowed(pool, _gene_rates, ( x for x, _ in fetched ),
+            max(1, prefetch))
+    else:
+        _init_worker(*initargs)
+        results = ( (x, get_gene_rates(x, _store, _mut_dict, transcripts))
+            for x, transcripts in fetched )
+    
+    try:
+        for symbol, rates in results:
+            print(symbol)
+            offset = write_gene(output, rates, header=offset == 0)
+            if checkpoint is not None:
+                with open(checkpoint, 'a') as handle:
+                    handle.write('{}\t{}\n'.format(symbol, offset))
+    finally:
+        if processes > 1:
+            pool.terminate()
+
 def main():
     
     args = get_options()
+    requester = ThrottledRequester(args.requests_per_second, args.retries,
+        server=args.ensembl_server)
+    fetch = {'requester': requester, 'threads': args.threads,
+        'prefetch': args.prefetch}
     
-    ensembl = EnsemblRequest('cache', 'grch37')
-    mut_dict = load_mutation_rates()
+    if args.exome:
+        genes = load_protein_coding(args.protein_coding)
+        
+        # each chromosome streams to its own file, so memory is bounded by the
+        # genes in flight, and finished chromosomes can be used straight away
+        for chrom, group in genes.groupby('chrom', sort=False):
+            output = shard_path(args.output, chrom)
+            stream_rates(list(group['symbol']), output, output + '.done',
+                args.processes, **fetch)
+            
+            if args.store is not None:
+                write_store(load_rates(output), shard_path(args.store, chrom))
+        return
     
     dominant = load_dominant(args.known)
     
-    data = pandas.DataFrame(columns=['symbol', 'chrom', 'pos', 'ref', 'alt',
-        'cq', 'prob'])
-    data['pos'] = data['pos'].astype(int)
-    for symbol in dominant:
-        print(symbol)
-        rates = get_gene_rates(symbol, ensembl, mut_dict)
-        data = data.append(rates, ignore_index=True)
+    stream_rates(sorted(dominant), args.output, args.checkpoint,
+        args.processes, **fetch)
     
-    with gzip.open(args.output, 'wt') as handle:
-        data.to_csv(handle, sep='\t', index=False)
+    if args.store is not None:
+        write_store(load_rates(args.output), args.store)
 
 if __name__ == '__main__':
     main()
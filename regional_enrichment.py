@@ -1,18 +1,26 @@
 
+from multiprocessing import Pool
+
 from scipy.stats import chi2, poisson, fisher_exact
+import numpy
 import pandas
 
-from denovonear.ensembl_requester import EnsemblRequest
-from denovonear.load_gene import construct_gene_object
 from denovonear.load_mutation_rates import load_mutation_rates
-from denovonear.site_specific_rates import SiteRates
 
 from mupit.open_ddd_data import standardise_ddd_de_novos
 from mupit.mutation_rates import get_expected_mutations
 from mupit.count_de_novos import get_de_novo_counts
 
-from weights.constraint import get_constrained_positions, classify_de_novos_by_constraint
+from weights.constraint import get_transcript_regions, index_regions, \
+    coding_intervals, classify_de_novos_by_constraint
 from weights.load_data import load_de_novos, load_regional_constraint
+from weights.transcripts import get_store
+from weights.coordinates import CoordinateMapper
+from weights.site_rates import get_site_rates
+from weights.resampling import resample_enrichment
+from weights.cache import frame_hash
+from weights.pipeline import StageCache
+from weights.plot_enrichment import render_batch
 
 # compare enrichment of de novo mutations in dominant genes in regions of high
 # constraint vs regions without high constraint. Do PTV enrichment and PAV
@@ -23,18 +31,29 @@ constraint_path = '/nfs/users/nfs_j/jm33/apps/mutation_weights/genes_regional_da
 de_novos_path = '/lustre/scratch113/projects/ddd/users/jm33/de_novos.ddd_4k.ddd_only.2015-11-24.txt'
 validations_path = '/lustre/scratch113/projects/ddd/users/jm33/de_novos.validation_results.2015-11-24.txt'
 
-def get_gene_rates(tx, sites, cqs, constrained_sites):
+def site_positions(mapper, sites):
+    ''' get arrays of chromosomal positions and rates for a list of site dicts
+    '''
+    cds_pos = numpy.array([ x['pos'] for x in sites ], dtype=numpy.int64)
+    offset = numpy.array([ x['offset'] for x in sites ], dtype=numpy.int64)
+    prob = numpy.array([ x['prob'] for x in sites ])
+    
+    return mapper.to_chrom(cds_pos, offset), prob
+
+def get_gene_rates(tx, sites, cqs, regions):
     gene_rates = {'constrained': dict(zip(cqs, [0.0] * len(cqs))),
         'unconstrained': dict(zip(cqs, [0.0] * len(cqs)))}
+    chrom = tx.get_chrom()
+    mapper = CoordinateMapper.from_transcript(tx)
     for cq in cqs:
-        for choice in sites[cq]:
-            pos = tx.get_position_on_chrom(choice['pos'], choice['offset'])
-            
-            category = 'unconstrained'
-            if pos in constrained_sites:
-                category = 'constrained'
-                
-            gene_rates[category][cq] += choice['prob']
+        if len(sites[cq]) == 0:
+            continue
+        
+        pos, prob = site_positions(mapper, sites[cq])
+        constrained = regions.contains(chrom, pos)
+        
+        gene_rates['constrained'][cq] += prob[constrained].sum()
+        gene_rates['unconstrained'][cq] += prob[~constrained].sum()
     
     return gene_rates
 
@@ -69,15 +88,16 @@ def get_rates_by_constraint(constraint, cache_dir, threshold=1e-4, ratio=1.0):
     
     rates = {'constrained': [], 'unconstrained': []}
     mut_dict = load_mutation_rates()
-    ensembl = EnsemblRequest(cache_dir, 'grch37')
+    store = get_store(cache_dir, 'grch37')
+    transcript_regions = get_transcript_regions(constraint, cache_dir, threshold, ratio)
     for tx_id, group in constraint.groupby('transcript'):
-        tx = construct_gene_object(ensembl, tx_id.split('.')[0])
-        sites = SiteRates(tx, mut_dict)
+        tx = store.get(tx_id.split('.')[0])
+        sites = get_site_rates(tx, mut_dict)
         
-        constrained_sites = get_constrained_positions(tx, group, threshold, ratio)
+        regions = index_regions({tx_id: transcript_regions[tx_id]})
         
         cqs = ['nonsense', 'missense', 'synonymous', 'splice_lof', 'splice_region']
-        gene_rates = get_gene_rates(tx, sites, cqs, constrained_sites)
+        gene_rates = get_gene_rates(tx, sites, cqs, regions)
         
         # now add the gene rates to the larger list of all genes
         for category in ['constrained', 'unconstrained']:
@@ -103,8 +123,9 @@ def enrichment(observed, expected):
         
         ratio = obs/exp
         p_value = poisson.sf(obs - 1, exp)
+        ci = resample_enrichment([obs], [exp]).iloc[0]
         data[x] = {'ratio': ratio, 'p_value': p_value, 'observed': obs,
-            'expected': exp}
+            'expected': exp, 'ci': (ci['lower'], ci['upper'])}
     
     return data
 
@@ -116,14 +137,22 @@ def compare_regions(constrained, unconstrained, category):
     
     return fisher_exact(counts)
 
-def check_enrichment(constraint, de_novos, cache_dir, male, female, threshold, ratio):
-    rates = get_rates_by_constraint(constraint, cache_dir, threshold, ratio)
+def summarise_enrichment(rates, de_novos, in_constraint, male, female):
+    ''' compare enrichment in and out of constrained regions
+    
+    Args:
+        rates: dictionary of lists of per-gene rates, for constrained and
+            unconstrained regions
+        de_novos: DataFrame of de novos
+        in_constraint: list of booleans for whether each de novo is in a
+            constrained region
+        male: number of male probands
+        female: number of female probands
+    '''
     
     constrained_exp = get_expected_mutations(prepare_rates(rates['constrained']), male, female)
     unconstrained_exp = get_expected_mutations(prepare_rates(rates['unconstrained']), male, female)
     
-    in_constraint = classify_de_novos_by_constraint(constraint, de_novos, cache_dir, threshold, ratio)
-    
     constrained_obs = get_de_novo_counts(de_novos[in_constraint])
     unconstrained_obs = get_de_novo_counts(de_novos[[ not x for x in in_constraint ]])
     
@@ -137,14 +166,193 @@ def check_enrichment(constraint, de_novos, cache_dir, male, female, threshold, r
         'unconstrained_enrich': unconstrained_enrich,
         'PTV diff': ptv_diff, 'PAV diff': pav_diff}
 
+def check_enrichment(constraint, de_novos, cache_dir, male, female, threshold, ratio):
+    rates = get_rates_by_constraint(constraint, cache_dir, threshold, ratio)
+    in_constraint = classify_de_novos_by_constraint(constraint, de_novos, cache_dir, threshold, ratio)
+    
+    return summarise_enrichment(rates, de_novos, in_constraint, male, female)
+
+def summarise_regions(constraint, cache_dir):
+    ''' get per-region rate sums and statistics, independent of thresholds
+    
+    Each transcript and its sites are built once. Every site is assigned to
+    the constraint region (row of the constraint table) it falls in, so the
+    rates in constrained regions at any threshold are sums over the regions
+    passing that threshold. Nothing here depends on the de novos, so the
+    summary can be reused for new de novo freezes.
+    
+    Args:
+        constraint: DataFrame of regional constraint
+        cache_dir: path to Ensembl cache folder
+    
+    Returns:
+        dictionary of per-transcript details (genes), per-transcript rate totals
+        by consequence (totals), per-region p-values, obs/exp ratios, parent
+        transcript indices and rate sums by consequence (p_value, ratio,
+        transcript, sums), and the coding intervals of each region (intervals).
+    '''
+    
+    cqs = ['nonsense', 'missense', 'synonymous', 'splice_lof', 'splice_region']
+    mut_dict = load_mutation_rates()
+    store = get_store(cache_dir, 'grch37')
+    
+    genes, totals, sums = [], [], []
+    p_values, ratios, parents, intervals = [], [], [], []
+    for tx_id, group in constraint.groupby('transcript'):
+        tx = store.get(tx_id.split('.')[0])
+        sites = get_site_rates(tx, mut_dict)
+        chrom = tx.get_chrom()
+        mapper = CoordinateMapper.from_transcript(tx)
+        
+        genes.append({'symbol': list(group['gene'])[0], 'chrom': list(group['chr'])[0],
+            'length': tx.chrom_pos_to_cds(tx.get_cds_end())['pos']})
+        
+        # find the coding intervals for every region, whatever its statistics
+        offset = len(p_values)
+        starts, ends, region = coding_intervals(tx, group['amino_acids'].values, mapper)
+        tx_intervals = list(zip(starts, ends, region))
+        intervals += [ (chrom, start, end, offset + i) for start, end, i in tx_intervals ]
+        
+        p_values += list(chi2.sf(group['chisq_diff_null'], df=1))
+        ratios += list(group['obs_exp'])
+        parents += [len(genes) - 1] * len(group)
+        
+        tx_intervals = numpy.array(sorted(tx_intervals), dtype=numpy.int64).reshape(-1, 3)
+        tx_sums = numpy.zeros((len(group), len(cqs)))
+        tx_totals = numpy.zeros(len(cqs))
+        for j, cq in enumerate(cqs):
+            if len(sites[cq]) == 0:
+                continue
+            
+            pos, prob = site_positions(mapper, sites[cq])
+            tx_totals[j] = prob.sum()
+            
+            idx = numpy.searchsorted(tx_intervals[:, 0], pos, side='right') - 1
+            inside = idx >= 0
+            inside[inside] = pos[inside] <= tx_intervals[idx[inside], 1]
+            region = tx_intervals[idx[inside], 2]
+            numpy.add.at(tx_sums[:, j], region, prob[inside])
+        
+        totals.append(tx_totals)
+        sums.append(tx_sums)
+    
+    return {'genes': genes, 'totals': numpy.array(totals).reshape(-1, len(cqs)),
+        'p_value': numpy.array(p_values), 'ratio': numpy.array(ratios),
+        'transcript': numpy.array(parents, dtype=int),
+        'sums': numpy.concatenate(sums).reshape(-1, len(cqs)),
+        'intervals': pandas.DataFrame(intervals, columns=['chrom', 'start', 'end', 'region']),
+        'cqs': cqs}
+
+def region_pairs(intervals, de_novos):
+    ''' find which regions each de novo falls within
+    
+    Args:
+        intervals: DataFrame of region intervals, from summarise_regions
+        de_novos: DataFrame of de novos
+    
+    Returns:
+        list of arrays of de novo and region indices, where the de novo falls
+        in the region
+    '''
+    
+    pairs = [numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int)]
+    chroms = de_novos['chrom'].astype(str).values
+    for chrom, group in intervals.groupby(intervals['chrom'].astype(str)):
+        rows = numpy.where(chroms == chrom)[0]
+        order = numpy.argsort(de_novos['start_pos'].values[rows], kind='mergesort')
+        rows = rows[order]
+        positions = de_novos['start_pos'].values[rows]
+        
+        first = numpy.searchsorted(positions, group['start'].values, side='left')
+        last = numpy.searchsorted(positions, group['end'].values, side='right')
+        counts = last - first
+        
+        # expand each interval to the de novos between its first and last rows
+        within = numpy.repeat(first - numpy.cumsum(counts) + counts, counts) + \
+            numpy.arange(counts.sum())
+        pairs[0] = numpy.concatenate([pairs[0], rows[within]])
+        pairs[1] = numpy.concatenate([pairs[1], numpy.repeat(group['region'].values, counts)])
+    
+    return pairs
+
+def sweep_cell(summary, pairs, de_novos, male, female, threshold, ratio):
+    ''' check enrichment for one threshold and ratio, from region summaries
+    '''
+    
+    # regions with missing statistics are not excluded, as in get_constrained_regions
+    passed = ~(summary['p_value'] > threshold) & ~(summary['ratio'] > ratio)
+    
+    constrained = numpy.zeros(summary['totals'].shape)
+    numpy.add.at(constrained, summary['transcript'][passed], summary['sums'][passed])
+    unconstrained = summary['totals'] - constrained
+    
+    rates = {'constrained': [], 'unconstrained': []}
+    for category, values in [('constrained', constrained), ('unconstrained', unconstrained)]:
+        for gene, row in zip(summary['genes'], values):
+            gene_rates = dict(zip(summary['cqs'], row))
+            gene_rates.update(gene)
+            rates[category].append(gene_rates)
+    
+    de_novo_idx, region_idx = pairs
+    in_constraint = numpy.zeros(len(de_novos), dtype=bool)
+    in_constraint[de_novo_idx[passed[region_idx]]] = True
+    
+    return summarise_enrichment(rates, de_novos, list(in_constraint), male, female)
+
+def _init_sweep(*args):
+    global _sweep_args
+    _sweep_args = args
+
+def _sweep_cell(cell):
+    return sweep_cell(*(_sweep_args + cell))
+
+def sweep(summary, de_novos, male, female, thresholds, ratios, processes=1):
+    ''' check enrichment across a grid of thresholds and obs/exp ratios
+    
+    Transcripts, site rates and region statistics come from a summary made
+    once (see summarise_regions), so only the de novos are matched to regions
+    here, then each grid cell only sums the regions passing its thresholds.
+    
+    Returns:
+        list of (threshold, ratio, result) tuples, in grid order
+    '''
+    
+    pairs = region_pairs(summary['intervals'], de_novos)
+    
+    args = (summary, pairs, de_novos, male, female)
+    cells = [ (x, y) for x in thresholds for y in ratios ]
+    if processes > 1:
+        pool = Pool(processes, initializer=_init_sweep, initargs=args)
+        results = pool.map(_sweep_cell, cells)
+        pool.close()
+    else:
+        _init_sweep(*args)
+        results = list(map(_sweep_cell, cells))
+    
+    return [ (x, y, result) for (x, y), result in zip(cells, results) ]
+
 constraint = load_regional_constraint(constraint_path)
+
+# the region summary only depends on the constraint table, so is cached for
+# reuse when a new de novo freeze arrives
+summary, _ = StageCache().run('summarise_regions', summarise_regions,
+    [constraint, cache_dir], deps=[frame_hash(constraint), cache_dir])
+
 de_novos = load_de_novos(de_novos_path, validations_path, keep_indels=True)
 de_novos = de_novos[de_novos['hgnc'].isin(constraint['gene'])]
 
 trios = {'male': 2408, 'female': 1885}
-for thresh in [1e-2, 1e-3, 1e-4, 1e-5, 1e-6]:
-    for ratio in [0.2, 0.4, 0.6, 0.8, 1.0]:
-        print(thresh, ratio)
-        result = check_enrichment(constraint, de_novos, cache_dir, trios['male'],
-            trios['female'], thresh, ratio)
-        print(result)
+results = sweep(summary, de_novos, trios['male'], trios['female'],
+    thresholds=[1e-2, 1e-3, 1e-4, 1e-5, 1e-6], ratios=[0.2, 0.4, 0.6, 0.8, 1.0],
+    processes=4)
+heatmaps = []
+for thresh, ratio, result in results:
+    print(thresh, ratio)
+    print(result)
+    for group in ['PTV', 'PAV']:
+        heatmaps.append({'name': 'regional_constraint.{}'.format(group),
+            'p-value': thresh, 'ratio': ratio,
+            'enrichment': result['constrained_enrich'][group]['ratio']})
+
+# heatmaps of enrichment in constrained regions across the sweep
+render_batch(pandas.DataFrame(heatmaps), '.', processes=2, kind='heatmap')
@@ -0,0 +1,53 @@
+
+import numpy
+import pytest
+
+from weights.coordinates import CoordinateMapper
+
+CDS = [(112, 119), (140, 146), (160, 170)]
+
+def make_transcript(strand):
+    transcript = pytest.importorskip('denovonear.transcript')
+    tx = transcript.Transcript('ENST00000001', '1', 110, 175, strand)
+    tx.set_exons([(110, 119), (140, 146), (160, 175)], CDS)
+    tx.set_cds(CDS)
+    
+    return tx
+
+def test_round_trip_in_transcript_direction():
+    mapper = CoordinateMapper(CDS, '-')
+    cds_pos = numpy.array([0, 10, 11, 25])
+    offset = numpy.array([0, 2, -2, 0])
+    
+    positions = mapper.to_chrom(cds_pos, offset)
+    assert list(positions) == [170, 158, 148, 112]
+    
+    pos, off = mapper.to_cds(positions)
+    assert list(pos) == list(cds_pos)
+    assert list(off) == list(offset)
+    assert list(mapper.in_coding_region(positions)) == [True, False, False, True]
+
+@pytest.mark.parametrize('strand', ['+', '-'])
+def test_matches_transcript(strand):
+    tx = make_transcript(strand)
+    mapper = CoordinateMapper.from_transcript(tx)
+    
+    for cds_pos in range(mapper.length):
+        for offset in [0, 1, 2, -1, -2]:
+            expected = tx.get_position_on_chrom(cds_pos, offset)
+            assert mapper.to_chrom([cds_pos], offset)[0] == expected
+
+@pytest.mark.parametrize('strand', ['+', '-'])
+def test_splice_sites_match_transcript(strand):
+    tx = make_transcript(strand)
+    mapper = CoordinateMapper.from_transcript(tx)
+    
+    # sites in the introns next to each CDS boundary
+    splice = numpy.array([120, 121, 138, 139, 147, 148, 158, 159])
+    pos, offset = mapper.to_cds(splice)
+    for site, cds_pos, off in zip(splice, pos, offset):
+        expected = tx.chrom_pos_to_cds(int(site))
+        assert (cds_pos, off) == (expected['pos'], expected['offset'])
+        assert tx.get_position_on_chrom(int(cds_pos), int(off)) == site
+    
+    assert list(mapper.to_chrom(pos, offset)) == list(splice)
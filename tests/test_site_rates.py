@@ -0,0 +1,32 @@
+
+import os
+
+import pytest
+
+pytest.importorskip('denovonear.site_specific_rates')
+
+from denovonear.load_mutation_rates import load_mutation_rates
+from denovonear.transcript import Transcript
+
+from weights import cache
+from weights.site_rates import get_site_rates
+from weights.transcripts import transcript_state, rebuild_transcript
+
+def test_rebuilt_transcript_uses_cached_rates(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path))
+    mut_dict = load_mutation_rates()
+    
+    tx = Transcript('ENST00000001', '1', 110, 149, '-')
+    tx.set_exons([(110, 119), (140, 149)], [(112, 119), (140, 146)])
+    tx.set_cds([(112, 119), (140, 146)])
+    tx.add_genomic_sequence('ACGTTGCAAC' * 6, offset=10)
+    
+    first = get_site_rates(tx, mut_dict)
+    second = get_site_rates(rebuild_transcript(transcript_state(tx)), mut_dict)
+    
+    assert first == second
+    assert len(os.listdir(tmp_path / 'site_rates')) == 1
+    
+    # masking sites gives a different key
+    get_site_rates(tx, mut_dict, masked_sites=tx)
+    assert sum( len(x) for _, _, x in os.walk(tmp_path / 'site_rates') ) == 2
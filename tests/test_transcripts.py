@@ -0,0 +1,49 @@
+
+import pickle
+
+import pytest
+
+pytest.importorskip('denovonear.transcript')
+
+from denovonear.transcript import Transcript
+
+from weights import cache
+from weights.transcripts import transcript_state, rebuild_transcript, TranscriptStore
+
+def make_transcript(strand):
+    ''' make a small two exon transcript, with 10 bp of flanking sequence
+    '''
+    tx = Transcript('ENST00000001', '1', 110, 149, strand)
+    tx.set_exons([(110, 119), (140, 149)], [(112, 119), (140, 146)])
+    tx.set_cds([(112, 119), (140, 146)])
+    
+    seq = 'ACGTTGCAAC' * 6
+    tx.add_genomic_sequence(seq, offset=10)
+    
+    return tx
+
+@pytest.mark.parametrize('strand', ['+', '-'])
+def test_transcript_state_round_trip(strand):
+    tx = make_transcript(strand)
+    
+    state = pickle.loads(pickle.dumps(transcript_state(tx)))
+    rebuilt = rebuild_transcript(state)
+    
+    assert repr(rebuilt) == repr(tx)
+    assert rebuilt.get_cds_sequence() == tx.get_cds_sequence()
+    assert rebuilt.get_codon_info(142) == tx.get_codon_info(142)
+
+def test_store_loads_cached_transcript(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path))
+    tx = make_transcript('-')
+    
+    store = TranscriptStore(str(tmp_path), requester=lambda *args: None)
+    monkeypatch.setattr('weights.transcripts.construct_gene_object',
+        lambda ensembl, tx_id: tx)
+    assert store.get('ENST00000001') is tx
+    
+    # a fresh store finds the transcript on disk, rather than from ensembl
+    store = TranscriptStore(str(tmp_path), requester=lambda *args: None)
+    monkeypatch.setattr('weights.transcripts.construct_gene_object', None)
+    assert repr(store.get('ENST00000001')) == repr(tx)
+    assert store.counts['disk'] == 1
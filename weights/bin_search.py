@@ -0,0 +1,166 @@
+
+import numpy
+
+def cumulative_curves(scores, expected, observed):
+    ''' sort sites by score once, and get cumulative expected and observed
+    
+    Args:
+        scores: array of scores per site. Sites without scores are dropped.
+        expected: array of expected de novo counts per site
+        observed: array of observed de novo counts per site
+    
+    Returns:
+        dictionary with the sorted scores, and prefix sums of the expected and
+        observed counts (each one longer than the scores, starting at zero).
+    '''
+    scores = numpy.asarray(scores, dtype=float)
+    expected = numpy.asarray(expected, dtype=float)
+    observed = numpy.asarray(observed, dtype=float)
+    
+    keep = ~numpy.isnan(scores)
+    order = numpy.argsort(scores[keep], kind='mergesort')
+    
+    return {'scores': scores[keep][order],
+        'expected': numpy.concatenate([[0], numpy.cumsum(expected[keep][order])]),
+        'observed': numpy.concatenate([[0], numpy.cumsum(observed[keep][order])])}
+
+def binned_curves(starts, expected, observed):
+    ''' get cumulative curves from per-bin sums, rather than per-site values
+    
+    Each bin acts as a single site scored at the bin's lower edge, so with
+    narrow bins this closely approximates cumulative_curves, without needing
+    every site in memory. Empty bins are dropped.
+    
+    Args:
+        starts: sorted array of lower bin edges
+        expected: array of expected de novo counts per bin
+        observed: array of observed de novo counts per bin
+    
+    Returns:
+        dictionary as for cumulative_curves
+    '''
+    starts = numpy.asarray(starts, dtype=float)
+    expected = numpy.asarray(expected, dtype=float)
+    observed = numpy.asarray(observed, dtype=float)
+    
+    keep = (expected > 0) | (observed > 0)
+    
+    return {'scores': starts[keep],
+        'expected': numpy.concatenate([[0], numpy.cumsum(expected[keep])]),
+        'observed': numpy.concatenate([[0], numpy.cumsum(observed[keep])])}
+
+def window_sums(curves, lower, upper=None):
+    ''' get expected and observed sums for sites with lower <= score < upper
+    
+    Each window costs two bisections, so arrays of windows are evaluated
+    without refiltering the sites.
+    
+    Args:
+        curves: dictionary from cumulative_curves()
+        lower: lower score threshold, or array of thresholds
+        upper: upper score threshold (or array), or None for no upper bound
+    
+    Returns:
+        tuple of (expected, observed) sums
+    '''
+    scores = curves['scores']
+    start = numpy.searchsorted(scores, lower, side='left')
+    end = len(scores) if upper is None else numpy.searchsorted(scores, upper, side='left')
+    
+    expected = curves['expected'][end] - curves['expected'][start]
+    observed = curves['observed'][end] - curves['observed'][start]
+    
+    return expected, observed
+
+def threshold_for_enrichment(curves, target, min_expected=1.0):
+    ''' find the lowest score threshold where sites above it reach a target
+    
+    This is for matching missense enrichment to a baseline, such as the
+    enrichment of PTVs in the same genes.
+    
+    Args:
+        curves: dictionary from cumulative_curves()
+        target: observed/expected ratio to reach
+        min_expected: ignore thresholds with fewer expected de novos above them
+    
+    Returns:
+        tuple of (threshold, ratio) for the lowest passing threshold, or
+        (None, None) if no threshold reaches the target.
+    '''
+    thresholds = numpy.unique(curves['scores'])
+    expected, observed = window_sums(curves, thresholds)
+    
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        ratio = observed / expected
+    
+    passing = numpy.where((ratio >= target) & (expected >= min_expected))[0]
+    if len(passing) == 0:
+        return None, None
+    
+    return thresholds[passing[0]], ratio[passing[0]]
+
+def _gain(observed, expected, baseline):
+    ''' log-likelihood gain from fitting a bin its own ratio, over the baseline
+    '''
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        gain = observed * numpy.log(observed / (expected * baseline)) - \
+            (observed - expected * baseline)
+    
+    return numpy.where(observed > 0, gain, expected * baseline)
+
+def optimal_edges(curves, n_bins, candidates=200, min_expected=1.0):
+    ''' find bin edges that best separate enrichment between bins
+    
+    Candidate edges are spaced evenly by expected count. Bins are chosen by
+    dynamic programming to maximise the Poisson log-likelihood gain of giving
+    each bin its own observed/expected ratio, compared to the overall ratio.
+    Every candidate bin is scored from the prefix sums, without refiltering.
+    
+    Args:
+        curves: dictionary from cumulative_curves()
+        n_bins: number of bins to split scores into
+        candidates: number of candidate edges to consider
+        min_expected: minimum expected de novos within each bin
+    
+    Returns:
+        numpy array of n_bins + 1 bin edges, for use with binned_enrichment()
+    '''
+    scores = curves['scores']
+    total_exp = curves['expected'][-1]
+    baseline = curves['observed'][-1] / total_exp
+    
+    # candidate edges at evenly spaced points of the cumulative expected curve
+    targets = numpy.linspace(0, total_exp, candidates + 1)[1:-1]
+    idx = numpy.searchsorted(curves['expected'], targets, side='left')
+    edges = numpy.unique(scores[numpy.clip(idx, 0, len(scores) - 1)])
+    edges = numpy.concatenate([[scores[0]], edges[edges > scores[0]],
+        [numpy.nextafter(scores[-1], numpy.inf)]])
+    
+    exp_at, obs_at = window_sums(curves, edges[0], edges)
+    
+    # expected and observed counts for every pair of candidate edges (i, j)
+    expected = exp_at[None, :] - exp_at[:, None]
+    observed = obs_at[None, :] - obs_at[:, None]
+    gain = numpy.where((expected >= min_expected) & (expected > 0),
+        _gain(observed, expected, baseline), -numpy.inf)
+    gain[numpy.tril_indices(len(edges))] = -numpy.inf
+    
+    # best[j] is the best total gain for bins covering edges[0] to edges[j]
+    best = gain[0].copy()
+    paths = [numpy.zeros(len(edges), dtype=int)]
+    for _ in range(1, n_bins):
+        totals = best[:, None] + gain
+        paths.append(numpy.argmax(totals, axis=0))
+        best = numpy.max(totals, axis=0)
+    
+    if not numpy.isfinite(best[-1]):
+        raise ValueError('cannot split scores into {} bins with at least {} ' \
+            'expected per bin'.format(n_bins, min_expected))
+    
+    # trace back the chosen edges from the final edge
+    chosen = [len(edges) - 1]
+    for path in reversed(paths[1:]):
+        chosen.append(path[chosen[-1]])
+    chosen.append(0)
+    
+    return edges[chosen[::-1]]
@@ -0,0 +1,56 @@
+
+import hashlib
+import json
+import os
+import tempfile
+
+import pandas
+
+CACHE_DIR = os.environ.get('MUTATION_WEIGHTS_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'mutation_weights'))
+
+def hash_key(*parts):
+    ''' get a hex digest for a list of JSON-serialisable parts
+    '''
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+def frame_hash(data):
+    ''' get a hex digest of the contents of a DataFrame
+    '''
+    hashed = pandas.util.hash_pandas_object(data, index=False).values
+    digest = hashlib.sha1(hashed.tobytes())
+    digest.update(json.dumps(list(map(str, data.columns))).encode('utf8'))
+    
+    return digest.hexdigest()
+
+def cache_path(*parts):
+    ''' get a path within the cache folder, creating the parent folders
+    '''
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    
+    return path
+
+def atomic_write(path, data, mode='w'):
+    ''' write to a temporary file, then move it into place
+    
+    Readers (including other processes) never see a partially written file.
+    '''
+    folder = os.path.dirname(os.path.abspath(path))
+    handle, temp = tempfile.mkstemp(dir=folder)
+    with os.fdopen(handle, mode) as output:
+        output.write(data)
+    os.replace(temp, path)
+
+def read_json(path, default=None):
+    ''' read a cached JSON file, or return a default if it isn't cached
+    '''
+    if not os.path.exists(path):
+        return default
+    
+    with open(path) as handle:
+        return json.load(handle)
+
+def write_json(path, data):
+    atomic_write(path, json.dumps(data))
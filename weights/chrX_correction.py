@@ -1,7 +1,17 @@
 
+import numpy
 import pandas
 
-def correct_for_x_chrom(rates, male_n, female_n):
+def x_factor(male_n, female_n, alpha=3.4):
+    ''' get the scaling factor for non-PAR chrX rates, relative to autosomes
+    
+    Args:
+        male_n: number of male probands (or an array of counts per cohort)
+        female_n: number of female probands (or an array of counts per cohort)
+        alpha: ratio of paternal to maternal de novo rates
+    '''
+    male_n = numpy.asarray(male_n, dtype=float)
+    female_n = numpy.asarray(female_n, dtype=float)
     
     autosomal = 2 * (male_n + female_n)
     female_transmit = male_n + female_n
@@ -9,17 +19,48 @@ def correct_for_x_chrom(rates, male_n, female_n):
     
     # get scaling factors using the alpha from the most recent SFHS (Scottish
     # Family Health Study) phased de novo data.
-    alpha = 3.4
     male_k = 2 / (1 + (1 / alpha))
     female_k = 2 / (1 + alpha)
     
+    return ((male_transmit * male_k) + (female_transmit * female_k)) / autosomal
+
+def correct_for_x_chrom(rates, male_n, female_n):
+    
     # correct the non-PAR chrX genes for fewer transmissions and lower rate
     # (dependent on alpha)
-    chrX = rates['chrom'].isin(['X', 'chrX'])
-    x_factor = ((male_transmit * male_k) + (female_transmit * female_k)) / autosomal
-    x_factor = pandas.Series([x_factor] * len(chrX), index=rates.index)
-    x_factor[~chrX] = 1
-    
-    rates['prob'] *= x_factor
+    chrX = rates['chrom'].isin(['X', 'chrX']).values
+    rates['prob'] *= numpy.where(chrX, x_factor(male_n, female_n), 1.0)
     
     return rates
+
+def expected_rate_matrix(rates, cohorts):
+    ''' get expected de novo counts per site for many cohorts at once
+    
+    The base rates table is left unchanged. Each cohort only needs an
+    autosomal and a chrX scaling factor, so the full matrix comes from one
+    broadcast of the per-site rates against those factors.
+    
+    Args:
+        rates: DataFrame of per-site mutation rates, with chrom and prob columns
+        cohorts: dictionary of {'male': count, 'female': count} dictionaries,
+            indexed by cohort name (or a DataFrame with male and female
+            columns, indexed by cohort name).
+    
+    Returns:
+        pandas DataFrame of expected counts, with a row per site and a column
+        per cohort
+    '''
+    if not isinstance(cohorts, pandas.DataFrame):
+        cohorts = pandas.DataFrame.from_dict(cohorts, orient='index')
+    
+    male = cohorts['male'].values.astype(float)
+    female = cohorts['female'].values.astype(float)
+    autosomal = 2 * (male + female)
+    
+    # one row of factors for autosomal sites, and one row for chrX sites
+    factors = numpy.vstack([autosomal, autosomal * x_factor(male, female)])
+    chrX = rates['chrom'].isin(['X', 'chrX']).values.astype(int)
+    
+    matrix = rates['prob'].values[:, None] * factors[chrX]
+    
+    return pandas.DataFrame(matrix, index=rates.index, columns=cohorts.index)
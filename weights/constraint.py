@@ -1,56 +1,233 @@
 
+import numpy
+import pandas
 from scipy.stats import chi2
 
-def aa_to_chrom(tx, region):
-    ''' convert an amino acid region of a transcript to chromosomal coordinates
+from weights.cache import hash_key, frame_hash, cache_path, read_json, write_json
+from weights.coordinates import CoordinateMapper
+from weights.transcripts import get_store
+from weights.instrument import PROFILER
+
+def aa_to_chrom(tx, regions, mapper=None):
+    ''' convert amino acid regions of a transcript to chromosomal coordinates
     
     Args:
         tx: Transcript object for a gene
-        region: start and end amino acid positions (dash-separated) e.g. '1-260'
+        regions: list of start and end amino acid positions (dash-separated)
+            e.g. ['1-260', '261-400']
+        mapper: CoordinateMapper for the transcript, or None to build one
     
     Returns:
-        tuple of start and end chromosomal coordinates
+        tuple of numpy arrays of start and end chromosomal coordinates, with
+        the start below the end, whichever strand the transcript is on
     '''
-    start, end = region.split('-')
-    start = (int(start) - 1) * 3
-    end = ((int(end) - 1) * 3) + 2
+    if mapper is None:
+        mapper = CoordinateMapper.from_transcript(tx)
+    
+    bounds = numpy.array([ x.split('-') for x in regions ], dtype=numpy.int64).reshape(-1, 2)
+    start = mapper.to_chrom((bounds[:, 0] - 1) * 3)
+    end = mapper.to_chrom(((bounds[:, 1] - 1) * 3) + 2)
     
-    return tx.get_position_on_chrom(start), tx.get_position_on_chrom(end)
+    return numpy.minimum(start, end), numpy.maximum(start, end)
+
+def coding_intervals(tx, regions, mapper=None):
+    ''' get the coding intervals of amino acid regions, whatever their statistics
+    
+    Args:
+        tx: Transcript object for a gene
+        regions: list of amino acid regions e.g. ['1-260', '261-400']
+        mapper: CoordinateMapper for the transcript, or None to build one
+    
+    Returns:
+        tuple of numpy arrays of interval starts, ends (inclusive) and the
+        index of the region each interval came from
+    '''
+    if mapper is None:
+        mapper = CoordinateMapper.from_transcript(tx)
+    
+    starts, ends = aa_to_chrom(tx, regions, mapper)
+    
+    # only keep the parts of each region which fall in coding sequence
+    cds_starts, cds_ends = mapper.starts, mapper.ends
+    overlap = (cds_starts[None, :] <= ends[:, None]) & (cds_ends[None, :] >= starts[:, None])
+    region, exon = numpy.nonzero(overlap)
+    
+    return numpy.maximum(starts[region], cds_starts[exon]), \
+        numpy.minimum(ends[region], cds_ends[exon]), region
+
+def get_constrained_regions(tx, group, threshold=1e-4, ratio_threshold=1.0,
+        mapper=None):
+    ''' get the coding intervals within the constrained regions of a transcript
+    
+    Args:
+        tx: Transcript object for a gene
+        group: DataFrame of regional constraint rows for the transcript
+        threshold: maximum p-value for a region to count as constrained
+        ratio_threshold: maximum observed/expected ratio for a region to count
+            as constrained
+        mapper: CoordinateMapper for the transcript, or None to build one
+    
+    Returns:
+        list of (start, end) tuples of chromosomal coordinates (inclusive)
+    '''
+    
+    # only exclude regions whose statistics exceed the thresholds, so regions
+    # with missing statistics are kept
+    p_values = chi2.sf(group['chisq_diff_null'], df=1)
+    keep = ~(p_values > threshold) & ~(group['obs_exp'] > ratio_threshold).values
+    if not keep.any():
+        return []
+    
+    starts, ends, _ = coding_intervals(tx, group['amino_acids'].values[keep], mapper)
+    
+    return list(zip(starts.tolist(), ends.tolist()))
 
 def get_constrained_positions(tx, group, threshold=1e-4, ratio_threshold=1.0):
     ''' get all the positions in the constrained regions
     '''
     constraint_sites = set([])
-    for i, row in group.iterrows():
-        row = row.squeeze()
-        p_value = chi2.sf(row['chisq_diff_null'], df=1)
-        if p_value > threshold:
-            continue
+    for start, end in get_constrained_regions(tx, group, threshold, ratio_threshold):
+        constraint_sites |= set(range(start, end + 1))
+    
+    return constraint_sites
+
+class ConstrainedRegions(object):
+    ''' index of constrained coding intervals, for vectorised position lookups
+    
+    Intervals are held per chromosome as sorted arrays of starts and ends,
+    with overlapping intervals merged, so a position is constrained if the
+    closest interval starting at or before it also ends at or after it.
+    '''
+    
+    def __init__(self):
+        self.intervals = {}
+        self.index = None
+    
+    def add(self, chrom, intervals):
+        ''' add a list of (start, end) intervals for a chromosome
+        '''
+        self.intervals.setdefault(str(chrom), []).extend(intervals)
+        self.index = None
+    
+    def add_transcript(self, tx, group, threshold=1e-4, ratio=1.0):
+        ''' add the constrained regions from a transcript's constraint rows
+        '''
+        self.add(tx.get_chrom(), get_constrained_regions(tx, group, threshold, ratio))
+    
+    def _build(self):
+        self.index = {}
+        for chrom, intervals in self.intervals.items():
+            if len(intervals) == 0:
+                continue
+            
+            intervals = numpy.array(sorted(intervals), dtype=numpy.int64)
+            starts, ends = intervals[:, 0], numpy.maximum.accumulate(intervals[:, 1])
+            
+            # merge intervals which overlap or abut the preceding intervals
+            new = numpy.ones(len(starts), dtype=bool)
+            new[1:] = starts[1:] > ends[:-1] + 1
+            groups = numpy.cumsum(new) - 1
+            merged_ends = numpy.zeros(new.sum(), dtype=numpy.int64)
+            numpy.maximum.at(merged_ends, groups, ends)
+            
+            self.index[chrom] = (starts[new], merged_ends)
+    
+    def contains(self, chrom, positions):
+        ''' check whether positions fall within constrained regions
         
-        if row['obs_exp'] > ratio_threshold:
-            continue
+        Args:
+            chrom: chromosome name, or array of chromosome names per position
+            positions: array of chromosomal positions
         
-        region = row['amino_acids']
-        start, end = aa_to_chrom(tx, region)
-        if tx.get_strand() == '-':
-            start, end = end, start
+        Returns:
+            numpy boolean array, True for positions in constrained regions
+        '''
+        if self.index is None:
+            self._build()
         
-        for x in range(start, end + 1):
-            if tx.in_coding_region(x):
-                constraint_sites.add(x)
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        if numpy.ndim(chrom) == 0:
+            chrom = numpy.repeat(str(chrom), len(positions))
+        
+        # compare integer codes per distinct chromosome, rather than strings
+        codes, names = pandas.factorize(chrom)
+        
+        within = numpy.zeros(len(positions), dtype=bool)
+        for code, name in enumerate(names):
+            name = str(name)
+            if name not in self.index:
+                continue
+            
+            starts, ends = self.index[name]
+            rows = codes == code
+            pos = positions[rows]
+            idx = numpy.searchsorted(starts, pos, side='right') - 1
+            hit = idx >= 0
+            hit[hit] = pos[hit] <= ends[idx[hit]]
+            within[rows] = hit
+        
+        return within
+
+def get_transcript_regions(constraint, ensembl_dir, threshold=1e-4, ratio=1.0,
+        transcripts=None, build='grch37'):
+    ''' get constrained coding intervals per transcript, via an on-disk cache
     
-    return constraint_sites
+    The cache is keyed by the contents of the constraint table, the thresholds
+    and the genome build, so editing the constraint table or changing the
+    thresholds gives a fresh cache. Transcripts are added to the cache as they
+    are requested, and transcripts are only built for uncached transcripts.
+    
+    Args:
+        constraint: DataFrame of regional constraint, for all transcripts
+        ensembl_dir: path to Ensembl cache folder
+        threshold: maximum p-value for a region to count as constrained
+        ratio: maximum observed/expected ratio for a region to count as
+            constrained
+        transcripts: list of transcript IDs to get regions for, or None for
+            all transcripts in the constraint table
+        build: genome build for Ensembl requests
+    
+    Returns:
+        dictionary of [chrom, list of [start, end] intervals] lists, indexed by
+        transcript ID
+    '''
+    
+    key = hash_key(frame_hash(constraint), threshold, ratio, build)
+    path = cache_path('constraint', 'regions.{}.json'.format(key))
+    cached = read_json(path, default={})
+    
+    known = set(constraint['transcript'])
+    if transcripts is None:
+        transcripts = known
+    transcripts = set(transcripts) & known
+    
+    missing = transcripts - set(cached)
+    PROFILER.count('constraint_regions.hits', len(transcripts) - len(missing))
+    PROFILER.count('constraint_regions.misses', len(missing))
+    if len(missing) > 0:
+        store = get_store(ensembl_dir, build)
+        subset = constraint[constraint['transcript'].isin(missing)]
+        for tx_id, group in subset.groupby('transcript'):
+            tx = store.get(tx_id.split('.')[0])
+            intervals = get_constrained_regions(tx, group, threshold, ratio)
+            cached[tx_id] = [tx.get_chrom(), [ list(map(int, x)) for x in intervals ]]
+        write_json(path, cached)
+    
+    return { x: cached[x] for x in transcripts }
+
+def index_regions(transcript_regions):
+    ''' build a ConstrainedRegions index from per-transcript intervals
+    '''
+    regions = ConstrainedRegions()
+    for chrom, intervals in transcript_regions.values():
+        regions.add(chrom, [ tuple(x) for x in intervals ])
+    
+    return regions
 
 def classify_de_novos_by_constraint(constraint, de_novos, cache_dir, threshold=1e-4, ratio=1.0):
     ''' determine whether de novos fall within constrained regions
     '''
-    sites = set([])
-    ensembl = EnsemblRequest(cache_dir, 'grch37')
-    for tx_id, group in constraint.groupby('transcript'):
-        tx = construct_gene_object(ensembl, tx_id.split('.')[0])
-        constrained_sites = get_constrained_positions(tx, group, threshold, ratio)
-        
-        chrom = tx.get_chrom()
-        sites |= set(( (chrom, x) for x in constrained_sites ))
+    transcript_regions = get_transcript_regions(constraint, cache_dir, threshold, ratio)
+    regions = index_regions(transcript_regions)
     
-    return [ x in sites for x in zip(de_novos['chrom'], de_novos['start_pos']) ]
+    return list(regions.contains(de_novos['chrom'], de_novos['start_pos']))
@@ -0,0 +1,100 @@
+
+import numpy
+
+class CoordinateMapper(object):
+    ''' convert between CDS and chromosomal coordinates for a transcript
+    
+    The CDS exon boundaries are held as sorted arrays, along with the CDS
+    position of each exon's lowest base, so whole arrays of positions convert
+    with searchsorted, rather than a Transcript method call per site.
+    
+    CDS positions are 0-based from the start codon, and run along the
+    transcript (so from the highest coordinate for transcripts on the - strand),
+    as for Transcript.get_position_on_chrom(). Offsets are distances outside
+    the CDS base, e.g. for splice sites in the neighbouring introns. Older
+    denovonear releases (e.g. 0.5.4) count offsets up the chromosome on both
+    strands, while later releases count them in the direction of the
+    transcript, so from_transcript() checks which the transcript uses.
+    '''
+    
+    def __init__(self, cds_ranges, strand, offset_sign=None):
+        ranges = numpy.array(sorted( (min(x), max(x)) for x in cds_ranges ),
+            dtype=numpy.int64).reshape(-1, 2)
+        self.starts, self.ends = ranges[:, 0], ranges[:, 1]
+        self.strand = strand
+        
+        # chromosomal direction of a positive offset
+        if offset_sign is None:
+            offset_sign = 1 if strand == '+' else -1
+        self.offset_sign = offset_sign
+        
+        lengths = self.ends - self.starts + 1
+        self.length = int(lengths.sum())
+        
+        # CDS position of the lowest base in each exon, counting up the chromosome
+        self.offsets = numpy.concatenate([[0], numpy.cumsum(lengths)[:-1]])
+    
+    @classmethod
+    def from_transcript(cls, tx):
+        cds = [ (x['start'], x['end']) for x in tx.get_cds() ]
+        sign = tx.get_position_on_chrom(0, 1) - tx.get_position_on_chrom(0)
+        return cls(cds, tx.get_strand(), sign)
+    
+    def to_chrom(self, cds_pos, offset=0):
+        ''' convert CDS positions (and offsets) to chromosomal positions
+        
+        Args:
+            cds_pos: array of CDS positions
+            offset: array of offsets per position, or a single offset
+        
+        Returns:
+            numpy array of chromosomal positions
+        '''
+        cds_pos = numpy.asarray(cds_pos, dtype=numpy.int64)
+        offset = numpy.asarray(offset, dtype=numpy.int64)
+        
+        # count up the chromosome, rather than along the transcript
+        forward = cds_pos if self.strand == '+' else self.length - 1 - cds_pos
+        
+        exon = numpy.searchsorted(self.offsets, forward, side='right') - 1
+        exon = exon.clip(0, len(self.starts) - 1)
+        pos = self.starts[exon] + forward - self.offsets[exon]
+        
+        return pos + offset * self.offset_sign
+    
+    def to_cds(self, positions):
+        ''' convert chromosomal positions to CDS positions and offsets
+        
+        Positions outside the CDS are placed at the closest CDS base, with the
+        distance to that base as the offset.
+        
+        Args:
+            positions: array of chromosomal positions
+        
+        Returns:
+            tuple of numpy arrays of CDS positions and offsets
+        '''
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        
+        # find the exon starting at or before each position, then check if the
+        # next exon's start is closer than that exon's end
+        exon = numpy.searchsorted(self.starts, positions, side='right') - 1
+        after = (exon + 1).clip(0, len(self.starts) - 1)
+        exon = exon.clip(0, len(self.starts) - 1)
+        
+        base = positions.clip(self.starts[exon], self.ends[exon])
+        closer = numpy.abs(self.starts[after] - positions) < numpy.abs(positions - base)
+        exon = numpy.where(closer, after, exon)
+        base = numpy.where(closer, self.starts[after], base)
+        
+        forward = self.offsets[exon] + base - self.starts[exon]
+        offset = (positions - base) * self.offset_sign
+        if self.strand == '+':
+            return forward, offset
+        
+        return self.length - 1 - forward, offset
+    
+    def in_coding_region(self, positions):
+        ''' check whether chromosomal positions fall within the CDS
+        '''
+        return self.to_cds(positions)[1] == 0
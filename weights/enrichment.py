@@ -0,0 +1,126 @@
+
+import numpy
+import pandas
+
+from weights.site_keys import site_keys, drop_ref, isin_keys
+
+def site_observed(sites, de_novos):
+    ''' count the observed de novos at each site
+    
+    Args:
+        sites: DataFrame of sites, with chrom, pos and alt columns
+        de_novos: DataFrame of de novos, with chrom, start_pos and alt_allele
+            columns
+    
+    Returns:
+        numpy array of observed counts per site. Each site is counted at most
+        once, no matter how many probands share the de novo.
+    '''
+    
+    keys = drop_ref(sites['key'] if 'key' in sites else \
+        site_keys(sites['chrom'], sites['pos'], alt=sites['alt']))
+    de_novo_keys = drop_ref(de_novos['key'] if 'key' in de_novos else \
+        site_keys(de_novos['chrom'], de_novos['start_pos'], alt=de_novos['alt_allele']))
+    
+    return isin_keys(keys, de_novo_keys).astype(int)
+
+def binned_enrichment(scores, expected, observed, edges):
+    ''' find the enrichment of de novos within score bins, in a single pass
+    
+    Args:
+        scores: array of scores (e.g. CADD) per site
+        expected: array of expected de novo counts per site
+        observed: array of observed de novo counts per site
+        edges: sorted list of bin edges. Each bin includes sites with scores
+            >= the lower edge and < the upper edge. Sites outside the edges,
+            or without scores, are not counted.
+    
+    Returns:
+        pandas DataFrame with a row per bin, with the bin start and end, counts
+        of observed de novos, the sum of expected, the number of sites, and the
+        ratio of observed to expected.
+    '''
+    
+    scores = numpy.asarray(scores, dtype=float)
+    binned = binned_enrichment_matrix(scores[:, None], expected, observed, edges)
+    
+    return binned.drop(columns='name')
+
+def binned_enrichment_matrix(scores, expected, observed, edges):
+    ''' find the enrichment of de novos within bins of many scores at once
+    
+    Every score shares the expected and observed arrays, and all the bins
+    (across every score) are counted in one bincount over the whole matrix.
+    
+    Args:
+        scores: DataFrame (or 2-D array) of scores, with a row per site and a
+            column per score, e.g. CADD raw and scaled scores, or different
+            CADD versions
+        expected: array of expected de novo counts per site
+        observed: array of observed de novo counts per site
+        edges: sorted list of bin edges, shared by all the scores, or a
+            dictionary of bin edges per score column
+    
+    Returns:
+        pandas DataFrame with a row per bin per score, with the score name,
+        then columns as for binned_enrichment
+    '''
+    
+    if not isinstance(scores, pandas.DataFrame):
+        scores = pandas.DataFrame(scores)
+    if not isinstance(edges, dict):
+        edges = { x: edges for x in scores.columns }
+    
+    expected = numpy.asarray(expected, dtype=float)
+    observed = numpy.asarray(observed, dtype=float)
+    
+    # give every bin (for every score) its own slot, so one bincount covers
+    # the whole matrix. Sites outside a score's edges get a slot of -1.
+    slots = numpy.empty(scores.shape, dtype=numpy.int64)
+    names, starts, ends = [], [], []
+    for i, name in enumerate(scores.columns):
+        score_edges = numpy.asarray(edges[name], dtype=float)
+        n_bins = len(score_edges) - 1
+        
+        # sites with missing scores sort after the final edge, so they drop out
+        # along with any sites beyond the outer edges
+        bins = numpy.searchsorted(score_edges, scores[name].values.astype(float),
+            side='right') - 1
+        valid = (bins >= 0) & (bins < n_bins)
+        slots[:, i] = numpy.where(valid, bins + len(names), -1)
+        
+        names += [name] * n_bins
+        starts.append(score_edges[:-1])
+        ends.append(score_edges[1:])
+    
+    n_slots = len(names)
+    valid = slots >= 0
+    rows = numpy.nonzero(valid)[0]
+    slots = slots[valid]
+    
+    exp = numpy.bincount(slots, weights=expected[rows], minlength=n_slots)
+    obs = numpy.bincount(slots, weights=observed[rows], minlength=n_slots)
+    sites = numpy.bincount(slots, minlength=n_slots)
+    
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        ratio = obs / exp
+    
+    return pandas.DataFrame({'name': names, 'start': numpy.concatenate(starts),
+        'end': numpy.concatenate(ends), 'observed': obs, 'expected': exp,
+        'sites': sites, 'ratio': ratio},
+        columns=['name', 'start', 'end', 'observed', 'expected', 'sites', 'ratio'])
+
+def quantile_edges(scores, n_bins):
+    ''' get bin edges which split scores into bins of roughly equal size
+    
+    Useful for scores without a natural scale (e.g. CADD raw scores, or other
+    predictors), so they can be binned alongside scaled scores.
+    '''
+    
+    scores = numpy.asarray(scores, dtype=float)
+    edges = numpy.nanquantile(scores, numpy.linspace(0, 1, n_bins + 1))
+    
+    # extend the top edge, so the highest scoring sites fall in the last bin
+    edges[-1] = numpy.nextafter(edges[-1], numpy.inf)
+    
+    return numpy.unique(edges)
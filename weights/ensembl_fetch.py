@@ -0,0 +1,187 @@
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+
+from denovonear.ensembl_requester import EnsemblRequest
+
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+class RateLimiter(object):
+    ''' limit calls to a number per second, shared between threads
+    '''
+    
+    def __init__(self, per_second=15):
+        self.interval = 1.0 / per_second if per_second else 0.0
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+    
+    def wait(self):
+        ''' block until the next call is allowed
+        '''
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        
+        if delay > 0:
+            time.sleep(delay)
+
+class ThrottledEnsemblRequest(EnsemblRequest):
+    ''' EnsemblRequest with a shared rate limit, and retries with backoff
+    
+    Requests which miss the Ensembl cache go through open_url, so that is
+    where the shared rate limit, and retries for failed connections or
+    throttled (429) and unavailable (5xx) responses, are applied. The server
+    can be swapped, e.g. for a local stub server of recorded responses (see
+    weights.ensembl_stub), and responses can be recorded for such a stub.
+    '''
+    
+    def __init__(self, cache_folder, genome_build, limiter=None, retries=5,
+            backoff=1.0, server=None, recordings=None):
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.retries = retries
+        self.backoff = backoff
+        self.recordings = recordings
+        self._server_override = server
+        EnsemblRequest.__init__(self, cache_folder, genome_build)
+    
+    @property
+    def server(self):
+        if self._server_override is not None:
+            return self._server_override
+        return self.__dict__.get('_server')
+    
+    @server.setter
+    def server(self, value):
+        self.__dict__['_server'] = value
+    
+    def rate_limit_ensembl_requests(self):
+        # requests are limited by the shared limiter in open_url instead
+        pass
+    
+    def open_url(self, url, headers):
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            try:
+                response, status_code, response_headers = \
+                    EnsemblRequest.open_url(self, url, headers)
+            except OSError:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+                continue
+            
+            if status_code not in RETRY_STATUS or attempt == self.retries:
+                break
+            
+            # wait as long as the server asks, if it says. denovonear
+            # lowercases header names, but check any case to be safe
+            lowered = { k.lower(): v for k, v in (response_headers or {}).items() }
+            retry_after = lowered.get('retry-after')
+            delay = float(retry_after) if retry_after else self.backoff * 2 ** attempt
+            time.sleep(delay)
+        
+        if self.recordings is not None and status_code == 200:
+            path = url[len(self.server):] if url.startswith(self.server) else url
+            body = response.decode('utf8') if isinstance(response, bytes) else response
+            self.recordings[path] = body
+        
+        return response, status_code, response_headers
+
+class ThrottledRequester(object):
+    ''' make ThrottledEnsemblRequest objects which share one rate limit
+    
+    Pass this as the requester for a TranscriptStore, so the limit holds
+    across every thread fetching from Ensembl. Copies pickled to other
+    processes (e.g. worker processes) get their own limiter.
+    '''
+    
+    def __init__(self, per_second=15, retries=5, backoff=1.0, server=None,
+            recordings=None):
+        self.per_second = per_second
+        self.retries = retries
+        self.backoff = backoff
+        self.server = server
+        self.recordings = recordings
+        self.limiter = RateLimiter(per_second)
+    
+    def __call__(self, cache_folder, genome_build):
+        return ThrottledEnsemblRequest(cache_folder, genome_build, self.limiter,
+            self.retries, self.backoff, self.server, self.recordings)
+    
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['limiter']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.limiter = RateLimiter(self.per_second)
+
+def fetch_transcripts(symbol, store, executor=None):
+    ''' get the Transcript objects for a gene, fetching transcripts concurrently
+    
+    Args:
+        symbol: HGNC symbol for a gene
+        store: TranscriptStore object, to retrieve gene data with
+        executor: ThreadPoolExecutor to fetch transcripts with, or None to
+            fetch them one at a time
+    
+    Returns:
+        list of Transcript objects (see denovonear), sorted by size (longest
+        transcripts first). Transcripts which can't be built are skipped.
+    '''
+    
+    transcript_ids = store.transcript_ids(symbol)
+    ordered = sorted(transcript_ids, key=transcript_ids.get, reverse=True)
+    
+    def get(tx_id):
+        try:
+            return store.get(tx_id)
+        except ValueError:
+            return None
+    
+    if executor is None:
+        transcripts = map(get, ordered)
+    else:
+        transcripts = executor.map(get, ordered)
+    
+    return [ x for x in transcripts if x is not None ]
+
+def prefetch_transcripts(symbols, store, threads=4, ahead=8):
+    ''' fetch transcripts for genes ahead of the gene being used
+    
+    Genes are fetched on a thread pool, up to a number of genes ahead of the
+    one last yielded, so Ensembl round trips overlap with computing rates.
+    
+    Args:
+        symbols: iterable of HGNC symbols
+        store: TranscriptStore object, to retrieve gene data with
+        threads: number of threads to fetch with
+        ahead: maximum number of genes to fetch ahead
+    
+    Yields:
+        (symbol, list of Transcript objects) tuples, in the order of symbols
+    '''
+    
+    symbols = iter(symbols)
+    with ThreadPoolExecutor(threads) as genes, ThreadPoolExecutor(threads) as transcripts:
+        pending = deque()
+        
+        def submit():
+            for symbol in symbols:
+                pending.append((symbol, genes.submit(fetch_transcripts, symbol,
+                    store, transcripts)))
+                return True
+            return False
+        
+        for _ in range(max(1, ahead)):
+            if not submit():
+                break
+        
+        while pending:
+            symbol, future = pending.popleft()
+            submit()
+            yield symbol, future.result()
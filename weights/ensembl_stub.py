@@ -0,0 +1,96 @@
+''' local stub of the Ensembl REST server, serving recorded responses
+
+Responses are recorded by passing a dictionary as the recordings argument of
+ThrottledRequester (see weights.ensembl_fetch), and saving it as JSON. Point
+a requester's server at the stub to fetch transcripts offline, e.g.
+
+    python -m weights.ensembl_stub recordings.json --port 8000
+    python get_rates.py --ensembl-server http://localhost:8000
+'''
+
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class RecordedEnsemblHandler(BaseHTTPRequestHandler):
+    ''' serve recorded responses by request path (including the query)
+    
+    Unrecorded paths get a 400 response with an Ensembl style error. The
+    server can also fail a number of requests first (with a status such as
+    429 or 503), to exercise retries.
+    '''
+    
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            fail = server.failures > 0
+            if fail:
+                server.failures -= 1
+        
+        if fail:
+            self._send(server.failure_status, '{"error": "stub failure"}',
+                {'retry-after': '0'})
+        elif self.path in server.recordings:
+            self._send(200, server.recordings[self.path])
+        else:
+            self._send(400, json.dumps({'error': 'no recording for {}'.format(self.path)}))
+    
+    def _send(self, status, body, headers=None):
+        body = body.encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        # lowercase header names, as denovonear does when parsing responses
+        for key, value in (headers or {}).items():
+            self.send_header(key.lower(), value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+def serve(recordings, port=0, failures=0, failure_status=503):
+    ''' start a stub server on a background thread
+    
+    Args:
+        recordings: dictionary of response bodies, indexed by request path
+        port: port to listen on, or 0 for any free port
+        failures: number of requests to fail before serving recordings
+        failure_status: HTTP status for the failed requests
+    
+    Returns:
+        tuple of (server, URL for the server). Call server.shutdown() to stop
+        it. Paths requested so far are in server.requests.
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', port), RecordedEnsemblHandler)
+    server.recordings = recordings
+    server.failures = failures
+    server.failure_status = failure_status
+    server.requests = []
+    server.lock = threading.Lock()
+    
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    
+    return server, 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+def main():
+    parser = argparse.ArgumentParser(description='serve recorded Ensembl responses')
+    parser.add_argument('recordings', help='path to JSON of recorded responses')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    
+    with open(args.recordings) as handle:
+        recordings = json.load(handle)
+    
+    server, url = serve(recordings, args.port)
+    print('serving {} recorded responses at {}'.format(len(recordings), url))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
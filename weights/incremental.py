@@ -0,0 +1,141 @@
+
+import os
+import pickle
+
+import numpy
+import pandas
+
+from weights.cache import atomic_write
+from weights.site_keys import drop_ref, isin_keys
+
+def build_artifact(keys, scores, expected, strata, edges):
+    ''' index the expected side of binned enrichment, to reuse across freezes
+    
+    The per-bin expected sums and site counts don't depend on the de novos,
+    so they are computed once. Each site's bin (and its rank by score, for
+    cumulative curves) is kept alongside, so observed counts can be updated
+    from just the de novos which differ between freezes.
+    
+    Args:
+        keys: array of site keys per site
+        scores: array of scores per site. Sites without scores are dropped.
+        expected: array of expected de novo counts per site
+        strata: dictionary of boolean arrays per stratum, for the sites in
+            each stratum
+        edges: sorted list of bin edges
+    
+    Returns:
+        dictionary with the bin edges, site keys (without ref alleles), the
+        keys of the de novo sites counted so far (none), and per stratum the
+        bin and curve rank per site (-1 outside the stratum), the expected
+        sums, site counts and observed counts per bin, and the cumulative
+        curves (see cumulative_curves).
+    '''
+    
+    scores = numpy.asarray(scores, dtype=float)
+    expected = numpy.asarray(expected, dtype=float)
+    edges = numpy.asarray(edges, dtype=float)
+    n_bins = len(edges) - 1
+    
+    scored = ~numpy.isnan(scores)
+    scores, expected = scores[scored], expected[scored]
+    
+    bins = numpy.searchsorted(edges, scores, side='right') - 1
+    bins[(bins < 0) | (bins >= n_bins)] = -1
+    
+    artifact = {'edges': edges, 'keys': drop_ref(numpy.asarray(keys)[scored]),
+        'de_novos': numpy.zeros(0, dtype=numpy.int64), 'strata': {}}
+    for name, rows in strata.items():
+        rows = numpy.asarray(rows, dtype=bool)[scored]
+        slots = numpy.where(rows, bins, -1)
+        binned = slots >= 0
+        
+        # rank sites by score within the stratum, as for cumulative_curves
+        order = numpy.where(rows)[0]
+        order = order[numpy.argsort(scores[order], kind='mergesort')]
+        ranks = numpy.full(len(scores), -1, dtype=numpy.int64)
+        ranks[order] = numpy.arange(len(order))
+        
+        artifact['strata'][name] = {'slots': slots, 'ranks': ranks,
+            'expected': numpy.bincount(slots[binned], weights=expected[binned],
+                minlength=n_bins),
+            'sites': numpy.bincount(slots[binned], minlength=n_bins),
+            'observed': numpy.zeros(n_bins),
+            'scores': scores[order],
+            'cumulative': numpy.concatenate([[0], numpy.cumsum(expected[order])]),
+            'hits': numpy.zeros(len(order), dtype=numpy.int8)}
+    
+    return artifact
+
+def update_observed(artifact, de_novo_keys):
+    ''' update observed counts in place, for a new set of de novos
+    
+    Only sites gaining or losing a de novo relative to the previous de novos
+    are touched. As with site_observed, each site is counted at most once.
+    
+    Args:
+        artifact: dictionary from build_artifact
+        de_novo_keys: array of site keys for the new de novos
+    
+    Returns:
+        tuple of (number of de novo sites added, number removed)
+    '''
+    
+    new = numpy.unique(drop_ref(de_novo_keys))
+    new = new[new >= 0]
+    old = artifact['de_novos']
+    
+    added = numpy.setdiff1d(new, old, assume_unique=True)
+    removed = numpy.setdiff1d(old, new, assume_unique=True)
+    
+    gained = isin_keys(artifact['keys'], added)
+    lost = isin_keys(artifact['keys'], removed)
+    
+    for stratum in artifact['strata'].values():
+        n_bins = len(stratum['observed'])
+        for rows, change in [(gained, 1), (lost, -1)]:
+            slots = stratum['slots'][rows]
+            stratum['observed'] += change * numpy.bincount(slots[slots >= 0],
+                minlength=n_bins)
+            
+            ranks = stratum['ranks'][rows]
+            stratum['hits'][ranks[ranks >= 0]] = 1 if change > 0 else 0
+    
+    artifact['de_novos'] = new
+    
+    return len(added), len(removed)
+
+def artifact_binned(artifact, name):
+    ''' get the binned enrichment for a stratum, as from binned_enrichment
+    '''
+    stratum = artifact['strata'][name]
+    edges = artifact['edges']
+    
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        ratio = stratum['observed'] / stratum['expected']
+    
+    return pandas.DataFrame({'start': edges[:-1], 'end': edges[1:],
+        'observed': stratum['observed'], 'expected': stratum['expected'],
+        'sites': stratum['sites'], 'ratio': ratio},
+        columns=['start', 'end', 'observed', 'expected', 'sites', 'ratio'])
+
+def artifact_curves(artifact, name):
+    ''' get the cumulative curves for a stratum, as from cumulative_curves
+    '''
+    stratum = artifact['strata'][name]
+    
+    return {'scores': stratum['scores'], 'expected': stratum['cumulative'],
+        'observed': numpy.concatenate([[0], numpy.cumsum(stratum['hits'], dtype=float)])}
+
+def save_artifact(artifact, path):
+    atomic_write(path, pickle.dumps(artifact, protocol=pickle.HIGHEST_PROTOCOL),
+        mode='wb')
+
+def load_artifact(path):
+    ''' load a saved artifact, or return None if there isn't one
+    '''
+    if path is None or not os.path.exists(path):
+        return None
+    
+    with open(path, 'rb') as handle:
+        return pickle.load(handle)
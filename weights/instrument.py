@@ -0,0 +1,131 @@
+
+import atexit
+import csv
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+def rss_mb():
+    ''' get the current resident memory of this process, in MB
+    
+    Returns None where /proc isn't available (e.g. on macOS).
+    '''
+    try:
+        with open('/proc/self/statm') as handle:
+            pages = int(handle.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    
+    return pages * resource.getpagesize() / 1e6
+
+def reset_peak_rss():
+    ''' reset this process's peak resident memory to its current value
+    
+    Returns:
+        True if the peak was reset, or False if the kernel doesn't allow it
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as handle:
+            handle.write('5')
+    except OSError:
+        return False
+    
+    return True
+
+def peak_rss_mb():
+    ''' get the peak resident memory of this process (since it was last
+    reset), in MB, or None where /proc isn't available
+    '''
+    try:
+        with open('/proc/self/status') as handle:
+            for line in handle:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024 / 1e6
+    except (OSError, IndexError, ValueError):
+        pass
+    
+    return None
+
+class Profiler(object):
+    ''' opt-in record of time, memory and row counts per analysis stage
+    
+    Memory is recorded as the resident memory at the start and end of each
+    stage, and the change between them. Where the kernel allows the peak to be
+    reset, the peak within each stage is also recorded, otherwise that is left
+    empty, rather than reporting the peak for the whole process.
+    
+    When disabled, stages and counters do nothing, so the instrumentation can
+    stay in place at no cost.
+    '''
+    
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stages = []
+        self.counters = {}
+        self.lock = threading.Lock()
+    
+    @contextmanager
+    def stage(self, name):
+        ''' time a block of code
+        
+        Yields a dictionary for the stage, so the block can record the number
+        of rows it produced, e.g. stage['rows'] = len(data), or other counts
+        '''
+        record = {'stage': name, 'rows': None}
+        if not self.enabled:
+            yield record
+            return
+        
+        record['rss_start_mb'] = rss_mb()
+        reset = reset_peak_rss()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_seconds'] = time.perf_counter() - wall
+            record['cpu_seconds'] = time.process_time() - cpu
+            record['rss_end_mb'] = rss_mb()
+            record['rss_delta_mb'] = None
+            if record['rss_start_mb'] is not None and record['rss_end_mb'] is not None:
+                record['rss_delta_mb'] = record['rss_end_mb'] - record['rss_start_mb']
+            record['stage_peak_rss_mb'] = peak_rss_mb() if reset else None
+            self.stages.append(record)
+    
+    def count(self, name, n=1):
+        ''' increment a named counter, e.g. for cache hits and misses
+        '''
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+    
+    def write(self, path):
+        ''' write the report, as CSV if the path ends in .csv, otherwise JSON
+        
+        CSV reports have a row per stage, followed by a row per counter.
+        '''
+        if path.endswith('.csv'):
+            columns = ['stage', 'wall_seconds', 'cpu_seconds', 'rss_start_mb',
+                'rss_end_mb', 'rss_delta_mb', 'stage_peak_rss_mb', 'rows']
+            for record in self.stages:
+                columns += [ x for x in record if x not in columns ]
+            with open(path, 'w') as handle:
+                writer = csv.DictWriter(handle, fieldnames=columns + ['count'])
+                writer.writeheader()
+                for record in self.stages:
+                    writer.writerow(record)
+                for name, value in sorted(self.counters.items()):
+                    writer.writerow({'stage': name, 'count': value})
+        else:
+            with open(path, 'w') as handle:
+                json.dump({'stages': self.stages, 'counters': self.counters},
+                    handle, indent=2)
+
+# the profiler is enabled by pointing MUTATION_WEIGHTS_PROFILE at a report path,
+# which is written when the process exits
+REPORT_PATH = os.environ.get('MUTATION_WEIGHTS_PROFILE')
+PROFILER = Profiler(enabled=REPORT_PATH is not None)
+if REPORT_PATH is not None:
+    atexit.register(PROFILER.write, REPORT_PATH)
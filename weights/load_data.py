@@ -1,31 +1,182 @@
 
+import glob
+import gzip
+import io
+import re
+from itertools import islice
+
+import numpy
 import pandas
 
 from mupit.open_ddd_data import standardise_ddd_de_novos
 
-def load_rates(path):
-    ''' get a DataFrame of mutation rates by site
+from weights.site_store import is_store, load_store, iter_store, chrom_rank
+from weights.site_keys import site_keys, ALLELES
+
+def expand_shards(path):
+    ''' get the paths for a dataset split into shards (e.g. per chromosome)
+    
+    Args:
+        path: path to a single table or store, or a pattern for shards, either
+            as a glob (e.g. rates.chr*.txt.gz) or with a {chrom} placeholder.
+    
+    Returns:
+        list of paths, sorted by chromosome where the paths include one
     '''
     
-    rates = pandas.read_table(path)
-    rates['chrom'] = rates['chrom'].astype(str)
+    path = path.replace('{chrom}', '*')
+    if not glob.has_magic(path):
+        return [path]
+    
+    paths = glob.glob(path)
+    chroms = [ re.search(r'chr([0-9]+|[XYM]T?)', x) for x in paths ]
+    chroms = [ x.group(1) if x is not None else '' for x in chroms ]
+    
+    return [ x for _, _, x in sorted(zip(chrom_rank(chroms), chroms, paths)) ]
+
+TEXT_TYPES = {'chrom': 'category', 'symbol': 'category', 'cq': 'category',
+    'ref': 'category', 'alt': 'category', 'pos': numpy.int32}
+FLOAT_COLUMNS = ['prob', 'raw', 'score']
+
+def read_sites(path, float32=False):
+    ''' read a table of sites, from either a columnar store or a text table
+    
+    Text tables are read with compact types (categoricals for strings, int32
+    positions, and float32 rates and scores if float32 is set), so the table
+    is never held uncompacted. Sharded datasets are read shard by shard, and
+    joined into one table.
+    '''
+    
+    dtypes = dict(TEXT_TYPES)
+    if float32:
+        dtypes.update({ x: numpy.float32 for x in FLOAT_COLUMNS })
+    
+    tables = []
+    for x in expand_shards(path):
+        tables.append(load_store(x) if is_store(x) else
+            pandas.read_table(x, dtype=dtypes))
+    
+    # drop empty shards, whose columns have no types to infer
+    tables = [ x for x in tables if len(x) > 0 ] or tables[:1]
+    if len(tables) == 1:
+        return tables[0]
     
-    # fix an issue with duplicated entries
-    non_dups = rates[~rates[['chrom', 'pos', 'alt']].duplicated(keep=False)]
-    dups = rates[rates[['chrom', 'pos', 'alt']].duplicated(keep=False)]
-    dups = dups[~dups[['chrom', 'pos', 'alt']].duplicated(keep='first')]
-    rates = non_dups.append(dups, ignore_index=True)
+    # shards have their own categories, which need to match for the joined
+    # columns to stay categorical
+    for column in tables[0].columns:
+        types = [ x[column].dtype for x in tables ]
+        if all( isinstance(x, pandas.CategoricalDtype) for x in types ):
+            categories = types[0].categories
+            for x in types[1:]:
+                categories = categories.union(x.categories)
+            tables = [ x.assign(**{column: x[column].cat.set_categories(categories)})
+                for x in tables ]
     
-    return rates.sort_values(['symbol', 'chrom', 'pos'])
+    return pandas.concat(tables, ignore_index=True)
 
-def load_cadd(path):
-    ''' get cadd scores by sites
+def iter_sites(path, chunksize=1000000):
+    ''' read a table of sites in chunks, from a store, a text table or shards
+    
+    Chunks come in the order of the underlying file(s), and get a key column
+    if they don't already have one.
     '''
-    cadd = pandas.read_table(path)
-    cadd['chrom'] = cadd['chrom'].astype(str)
-    cadd['pos'] = cadd['pos'].astype(int)
     
-    return cadd
+    for x in expand_shards(path):
+        if is_store(x):
+            chunks = iter_store(x, chunksize)
+        else:
+            chunks = pandas.read_table(x, dtype={'chrom': str}, chunksize=chunksize)
+        
+        for chunk in chunks:
+            if 'key' not in chunk:
+                chunk['key'] = site_keys(chunk['chrom'], chunk['pos'],
+                    chunk['ref'], chunk['alt'])
+            yield chunk
+
+ALLELE_TYPE = pandas.CategoricalDtype(list(ALLELES))
+
+def compact_sites(data, float32=False):
+    ''' shrink a table of sites in place, to cut its memory footprint
+    
+    Chromosome, consequence and gene symbol become categoricals (with
+    chromosomes in genomic order), alleles become categoricals of the four
+    bases, which store one byte per site, and positions become int32.
+    
+    Args:
+        data: pandas DataFrame of sites
+        float32: whether to also store rates and scores (all float64
+            columns) as float32
+    
+    Returns:
+        the same DataFrame, with compact columns
+    '''
+    
+    if 'chrom' in data:
+        chroms = data['chrom']
+        if not isinstance(chroms.dtype, pandas.CategoricalDtype):
+            chroms = chroms.astype(str).astype('category')
+        names = list(chroms.cat.categories)
+        order = [ x for _, x in sorted(zip(chrom_rank(names), names)) ]
+        data['chrom'] = chroms.cat.reorder_categories(order)
+    
+    for column in ['cq', 'symbol']:
+        if column in data:
+            data[column] = data[column].astype('category')
+    
+    for column in ['ref', 'alt']:
+        if column in data:
+            data[column] = data[column].astype(ALLELE_TYPE)
+    
+    if 'pos' in data:
+        data['pos'] = data['pos'].astype(numpy.int32)
+    
+    if float32:
+        for column in data.select_dtypes(numpy.float64).columns:
+            data[column] = data[column].astype(numpy.float32)
+    
+    return data
+
+def is_stored(path):
+    ''' check if a dataset (or every shard of it) is held in site stores
+    '''
+    paths = expand_shards(path)
+    return len(paths) > 0 and all( is_store(x) for x in paths )
+
+def load_rates(path, float32=False):
+    ''' get a compact DataFrame of mutation rates by site
+    
+    Site stores are written from this function's output, so they are already
+    free of duplicates and sorted (by chromosome, position and alt), and are
+    used as loaded, with columns memory-mapped rather than copied. Text tables
+    are deduplicated and sorted by gene.
+    '''
+    
+    stored = is_stored(path)
+    rates = read_sites(path, float32)
+    if not stored:
+        # fix an issue with duplicated entries
+        non_dups = rates[~rates[['chrom', 'pos', 'alt']].duplicated(keep=False)]
+        dups = rates[rates[['chrom', 'pos', 'alt']].duplicated(keep=False)]
+        dups = dups[~dups[['chrom', 'pos', 'alt']].duplicated(keep='first')]
+        rates = pandas.concat([non_dups, dups], ignore_index=True)
+    
+    if 'key' not in rates:
+        rates['key'] = site_keys(rates['chrom'], rates['pos'], rates['ref'], rates['alt'])
+    
+    rates = compact_sites(rates, float32)
+    if not stored:
+        rates = rates.sort_values(['symbol', 'chrom', 'pos'])
+    
+    return rates
+
+def load_cadd(path, float32=False):
+    ''' get compact cadd scores by sites
+    '''
+    cadd = read_sites(path, float32)
+    if 'key' not in cadd:
+        cadd['key'] = site_keys(cadd['chrom'], cadd['pos'], cadd['ref'], cadd['alt'])
+    
+    return compact_sites(cadd, float32)
 
 def count_trios(trios_path, families_path):
     ''' count the number of male and female trios in the cohort
@@ -39,22 +190,75 @@ def count_trios(trios_path, families_path):
     
     return dict(families.sex.value_counts())
 
-def load_de_novos(de_novos_path, validations_path, keep_indels=False):
+VALIDATION_KEY = ["person_id", "chrom", "start_pos", "end_pos", "ref_allele",
+    "alt_allele", "hgnc", "consequence"]
+FAILED = ["false_positive", "inherited"]
+
+def hash_validation_keys(variants):
+    ''' hash the columns which identify a validated de novo into uint64s
+    '''
+    return pandas.util.hash_pandas_object(variants[VALIDATION_KEY].astype(str),
+        index=False).values
+
+def load_failed_validations(path, chunksize=100000):
+    ''' get hashed keys for de novos which failed validation
+    
+    Only the key columns and validation status are read, as strings, and only
+    the failed rows are kept, so memory scales with the failed de novos.
+    '''
+    
+    dtypes = dict(zip(VALIDATION_KEY + ['status'], [str] * (len(VALIDATION_KEY) + 1)))
+    failed = [numpy.zeros(0, dtype=numpy.uint64)]
+    for chunk in pandas.read_table(path, sep="\t", usecols=list(dtypes),
+            dtype=dtypes, chunksize=chunksize):
+        chunk = chunk[chunk["status"].isin(FAILED)]
+        failed.append(hash_validation_keys(chunk))
+    
+    return numpy.unique(numpy.concatenate(failed))
+
+def read_chunks(path, chunksize=100000):
+    ''' split a table into chunks of lines, each with the header line
     '''
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as handle:
+        header = handle.readline()
+        while True:
+            lines = list(islice(handle, chunksize))
+            if len(lines) == 0:
+                break
+            yield io.StringIO(header + ''.join(lines))
+
+DE_NOVO_TYPES = {'chrom': str, 'start_pos': numpy.int32, 'end_pos': numpy.int32}
+
+def load_de_novos(de_novos_path, validations_path, keep_indels=False,
+        chunksize=100000):
+    ''' load de novos, excluding those which failed validation
+    
+    Both tables are read in chunks. Validations are matched by hashing the
+    identifying columns, and failed or non-SNV de novos are dropped from each
+    chunk as it is read.
+    
+    standardise_ddd_de_novos() reads each chunk with inferred types, which can
+    differ between chunks (e.g. chromosomes as integers in chunks without X),
+    so chunks are given fixed types as they are standardised.
     '''
-    variants = standardise_ddd_de_novos(de_novos_path)
     
-    validations = pandas.read_table(validations_path, sep="\t")
-    variants = variants.merge(validations, how="left",
-        on=["person_id", "chrom", "start_pos", "end_pos", "ref_allele",
-            "alt_allele", "hgnc", "consequence"])
+    failed = load_failed_validations(validations_path, chunksize)
     
-    variants = variants[~variants["status"].isin(["false_positive", "inherited"])]
-    del variants["status"]
+    chunks = []
+    for chunk in read_chunks(de_novos_path, chunksize):
+        variants = standardise_ddd_de_novos(chunk).astype(DE_NOVO_TYPES)
+        variants = variants[~numpy.isin(hash_validation_keys(variants), failed)]
+        
+        if not keep_indels:
+            # we only want SNVs for this
+            variants = variants[variants['type'] == 'snv']
+        
+        chunks.append(variants)
     
-    if not keep_indels:
-        # we only want SNVs for this
-        variants = variants[variants['type'] == 'snv']
+    variants = pandas.concat(chunks, ignore_index=True)
+    variants['key'] = site_keys(variants['chrom'], variants['start_pos'],
+        variants['ref_allele'], variants['alt_allele'])
     
     return variants
 
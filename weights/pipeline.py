@@ -0,0 +1,143 @@
+
+import os
+import pickle
+
+from weights.cache import CACHE_DIR, hash_key, atomic_write
+from weights.instrument import PROFILER
+from weights.load_data import expand_shards
+
+def file_key(path):
+    ''' identify a dataset by the path, size and modification time of its files
+    
+    Shard patterns are expanded to their shards, and folders (e.g. site
+    stores) are identified by every file within them, as rewriting a store in
+    place doesn't change the folder's own size or modification time.
+    '''
+    files = []
+    for shard in expand_shards(path):
+        if os.path.isdir(shard):
+            files += sorted( os.path.join(shard, x) for x in os.listdir(shard) )
+        else:
+            files.append(shard)
+    
+    key = []
+    for x in files:
+        stat = os.stat(x)
+        key.append([os.path.abspath(x), stat.st_size, stat.st_mtime_ns])
+    
+    return key
+
+class Stage(object):
+    ''' a pipeline stage, whose output is loaded or computed on first use
+    
+    The stage's key is known without its output, so downstream stages can be
+    keyed (and loaded from the cache) without loading or running the stages
+    upstream of them. Stages given as arguments (or dependencies) of another
+    stage are replaced by their outputs (or keys).
+    '''
+    
+    def __init__(self, cache, name, func, args=(), deps=(), params=None,
+            outputs=(), counts=None, save=True):
+        self.cache = cache
+        self.name = name
+        self.func = func
+        self.args = args
+        self.params = params or {}
+        self.outputs = outputs
+        self.counts = counts
+        self.save = save
+        
+        deps = [ x.key if isinstance(x, Stage) else x for x in deps ]
+        self.key = hash_key(name, deps, self.params)
+        self._output = None
+        self._done = False
+    
+    @property
+    def output(self):
+        if not self._done:
+            self._output = self.cache.evaluate(self)
+            self._done = True
+            self.args = None
+        
+        return self._output
+
+class StageCache(object):
+    ''' cache of pipeline stage outputs, keyed by their inputs and parameters
+    
+    Each stage's key is a hash of the stage name, the keys of its inputs
+    (upstream stage keys, or file keys) and its parameters. Changing a
+    parameter changes that stage's key, and so the keys of every stage
+    downstream of it, while upstream stages are loaded from the cache.
+    '''
+    
+    def __init__(self, folder=os.path.join(CACHE_DIR, 'pipeline'), enabled=True):
+        self.folder = folder
+        self.enabled = enabled
+    
+    def _path(self, stage):
+        return os.path.join(self.folder, '{}.{}.pkl'.format(stage.name, stage.key))
+    
+    def stage(self, name, func, args=(), deps=(), params=None, outputs=(),
+            counts=None, save=True):
+        ''' set up a stage, to be loaded or run once its output is used
+        
+        Args:
+            name: name of the stage
+            func: function to run the stage
+            args: arguments to pass to the function, including upstream Stages
+            deps: list of keys (or Stages) for the stage's inputs
+            params: dictionary of parameters that change the stage's output
+                (and which are passed to the function as keyword arguments)
+            outputs: list of files the stage writes. The stage reruns if any
+                of these are missing, even if its output is cached.
+            counts: function to get a dictionary of counts from the stage
+                output, to add to the profiler report. Tables (and arrays)
+                report their length as rows, and other outputs report no rows.
+            save: whether to pickle the stage output. Outputs which are
+                quicker to rebuild than to load (e.g. tables loaded from
+                memory-mapped site stores) needn't be saved.
+        
+        Returns:
+            Stage object
+        '''
+        return Stage(self, name, func, args, deps, params, outputs, counts, save)
+    
+    def run(self, name, func, args=(), deps=(), params=None, outputs=(),
+            counts=None, save=True):
+        ''' run a stage, or load its output if it was cached with the same key
+        
+        Takes the same arguments as StageCache.stage()
+        
+        Returns:
+            tuple of (stage output, stage key)
+        '''
+        stage = self.stage(name, func, args, deps, params, outputs, counts, save)
+        return stage.output, stage.key
+    
+    def evaluate(self, stage):
+        ''' load a stage's cached output, or run the stage
+        '''
+        path = self._path(stage)
+        cached = self.enabled and stage.save
+        
+        written = all( os.path.exists(x) for x in stage.outputs )
+        if cached and written and os.path.exists(path):
+            PROFILER.count('pipeline.{}.hits'.format(stage.name))
+            with open(path, 'rb') as handle:
+                return pickle.load(handle)
+        
+        PROFILER.count('pipeline.{}.misses'.format(stage.name))
+        args = [ x.output if isinstance(x, Stage) else x for x in stage.args ]
+        with PROFILER.stage(stage.name) as record:
+            result = stage.func(*args, **stage.params)
+            if hasattr(result, 'shape'):
+                record['rows'] = len(result)
+            if stage.counts is not None:
+                record.update(stage.counts(result))
+        
+        if cached:
+            if not os.path.exists(self.folder):
+                os.makedirs(self.folder)
+            atomic_write(path, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL), mode='wb')
+        
+        return result
@@ -1,17 +1,24 @@
 
+import json
 import os
+from multiprocessing import Pool
+
+import numpy
+import pandas
 
 import matplotlib
 matplotlib.use('agg')
 
 from matplotlib import pyplot
 
-def plot_enrichment(threshold, enrichment, cdf, path='temp.pdf'):
-    ''' plots enrichment of de novos at different CADD thresholds
+from weights.cache import hash_key
+
+MANIFEST = '.plots.json'
+
+def draw_enrichment(ax, threshold, enrichment, cdf, title=None):
+    ''' draw enrichment of de novos at different CADD thresholds on an axis
     '''
     
-    fig = pyplot.figure(figsize=(6, 6))
-    ax = fig.gca()
     cdf_ax = ax.twinx()
     
     plot1 = ax.plot(threshold, enrichment, linestyle='None', marker='.',
@@ -45,7 +52,137 @@ def plot_enrichment(threshold, enrichment, cdf, path='temp.pdf'):
     labs = [ l.get_label() for l in plot1 + plot2 ]
     e = ax.legend(plot1 + plot2, labs, frameon=False)
     
+    if title is not None:
+        e = ax.set_title(title, fontsize=15)
+
+def plot_enrichment(threshold, enrichment, cdf, path='temp.pdf'):
+    ''' plots enrichment of de novos at different CADD thresholds
+    '''
+    
+    fig = pyplot.figure(figsize=(6, 6))
+    draw_enrichment(fig.gca(), threshold, enrichment, cdf)
+    
     filetype = os.path.splitext(path)[1][1:]
     
     fig.savefig(path, dpi=300, format=filetype, bbox_inches='tight', pad_inches=0,
         transparent=True)
+    pyplot.close(fig)
+
+def draw_heatmap(ax, p_value, ratio, enrichment, title=None):
+    ''' draw enrichment across p-value and ratio thresholds as a heatmap on an axis
+    '''
+    
+    data = pandas.DataFrame({'p-value': p_value, 'ratio': ratio,
+        'enrichment': enrichment})
+    data = data.pivot(index='p-value', columns='ratio', values='enrichment')
+    
+    mesh = ax.pcolor(data, cmap=pyplot.cm.Blues, alpha=0.8)
+    e = ax.figure.colorbar(mesh, ax=ax)
+    
+    e = ax.set_xticks(numpy.arange(len(data.columns)) + 0.5)
+    e = ax.set_yticks(numpy.arange(len(data.index)) + 0.5)
+    e = ax.set_xticklabels(data.columns, minor=False, fontsize=15)
+    e = ax.set_yticklabels(data.index, minor=False, fontsize=15)
+    
+    e = ax.set_xlabel('Observed/expected ratio', fontsize=15)
+    e = ax.set_ylabel('observed/expected p-value', fontsize=15)
+    
+    if title is not None:
+        e = ax.set_title(title, fontsize=15)
+
+# the columns each kind of panel is drawn from, in the order the draw function
+# takes them
+PANELS = {'enrichment': (draw_enrichment, ['threshold', 'enrichment', 'cdf']),
+    'heatmap': (draw_heatmap, ['p-value', 'ratio', 'enrichment'])}
+
+def _render(job):
+    ''' render one file, with one or more panels
+    '''
+    path, kind, panels = job
+    draw, columns = PANELS[kind]
+    
+    fig, axes = pyplot.subplots(1, len(panels), figsize=(6 * len(panels), 6),
+        squeeze=False)
+    for ax, panel in zip(axes[0], panels):
+        title = panel['name'] if len(panels) > 1 else None
+        draw(ax, *[ panel[x] for x in columns ], title=title)
+    
+    if len(panels) > 1:
+        fig.tight_layout()
+    
+    filetype = os.path.splitext(path)[1][1:]
+    fig.savefig(path, dpi=300, format=filetype, bbox_inches='tight', pad_inches=0,
+        transparent=True)
+    pyplot.close(fig)
+    
+    return path
+
+def render_batch(results, folder, processes=1, per_page=None, filetype='pdf',
+        kind='enrichment'):
+    ''' render plots for many strata, scores, cohorts or sweeps at once
+    
+    Files are rendered across a process pool. A manifest in the output folder
+    (.plots.json) records a hash of each file's inputs, and files whose inputs
+    haven't changed (and which still exist) are skipped.
+    
+    Args:
+        results: DataFrame with a row per bin (or heatmap cell), with name
+            (the panel name) and the columns for the kind of panel: threshold,
+            enrichment and cdf for enrichment plots, or p-value, ratio and
+            enrichment for heatmaps
+        folder: folder to write plots to
+        processes: number of processes to render with
+        per_page: None to write each panel to its own file (NAME.pdf), or the
+            number of panels per page, to write pages (page_N.pdf)
+        filetype: file extension for the plots
+        kind: kind of panel, either 'enrichment' (enrichment and CDF across
+            CADD thresholds) or 'heatmap' (enrichment across p-value and
+            ratio thresholds)
+    
+    Returns:
+        list of paths for all the plots, whether rendered or skipped
+    '''
+    
+    columns = PANELS[kind][1]
+    panels = []
+    for name, group in results.groupby('name', sort=False):
+        panel = { x: [ float(y) for y in group[x] ] for x in columns }
+        panel['name'] = str(name)
+        panels.append(panel)
+    
+    if per_page is None:
+        jobs = [ (os.path.join(folder, '{}.{}'.format(x['name'], filetype)), [x])
+            for x in panels ]
+    else:
+        jobs = [ (os.path.join(folder, 'page_{}.{}'.format(i // per_page + 1, filetype)),
+            panels[i:i + per_page]) for i in range(0, len(panels), per_page) ]
+    
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    
+    manifest_path = os.path.join(folder, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as handle:
+            manifest = json.load(handle)
+    
+    hashes = { path: hash_key(kind, page) for path, page in jobs }
+    
+    todo = [ (path, kind, page) for path, page in jobs
+        if manifest.get(path) != hashes[path] or not os.path.exists(path) ]
+    
+    if processes > 1 and len(todo) > 1:
+        pool = Pool(processes)
+        try:
+            pool.map(_render, todo)
+        finally:
+            pool.close()
+    else:
+        for job in todo:
+            _render(job)
+    
+    manifest.update(hashes)
+    with open(manifest_path, 'w') as handle:
+        json.dump(manifest, handle, indent=2, sort_keys=True)
+    
+    return [ path for path, _ in jobs ]
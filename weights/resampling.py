@@ -0,0 +1,97 @@
+
+from multiprocessing import Pool
+
+import numpy
+import pandas
+
+def _split(replicates, seed, processes):
+    ''' split replicates into chunks, each with an independent random seed
+    '''
+    chunks = max(1, processes)
+    sizes = [ replicates // chunks + (i < replicates % chunks) for i in range(chunks) ]
+    if not isinstance(seed, numpy.random.SeedSequence):
+        seed = numpy.random.SeedSequence(seed)
+    seeds = seed.spawn(chunks)
+    
+    return [ (size, x) for size, x in zip(sizes, seeds) if size > 0 ]
+
+def _map(func, jobs, processes):
+    if processes > 1:
+        pool = Pool(processes)
+        try:
+            return pool.map(func, jobs)
+        finally:
+            pool.close()
+    
+    return list(map(func, jobs))
+
+def _poisson(args):
+    size, seed, observed = args
+    return numpy.random.default_rng(seed).poisson(observed, size=(size, len(observed)))
+
+def _multinomial(args):
+    size, seed, total, probs = args
+    return numpy.random.default_rng(seed).multinomial(total, probs, size=size)
+
+def bootstrap_counts(observed, replicates=10000, seed=None, processes=1):
+    ''' draw bootstrap replicates of observed counts per bin
+    
+    Each bin's count is resampled from a Poisson distribution around the
+    observed count, with all replicates drawn as one matrix per process.
+    
+    Returns:
+        numpy array of counts, with a row per replicate and a column per bin
+    '''
+    observed = numpy.asarray(observed, dtype=float)
+    jobs = [ (size, x, observed) for size, x in _split(replicates, seed, processes) ]
+    
+    return numpy.concatenate(_map(_poisson, jobs, processes))
+
+def permute_counts(observed, expected, replicates=10000, seed=None, processes=1):
+    ''' draw null counts per bin, with de novos distributed by expected rate
+    
+    The total observed count is kept, but the de novos are allocated to bins
+    in proportion to each bin's expected count, as if scores had no bearing
+    on where de novos fall.
+    
+    Returns:
+        numpy array of counts, with a row per replicate and a column per bin
+    '''
+    expected = numpy.asarray(expected, dtype=float)
+    total = int(round(numpy.sum(observed)))
+    probs = expected / expected.sum()
+    jobs = [ (size, x, total, probs) for size, x in _split(replicates, seed, processes) ]
+    
+    return numpy.concatenate(_map(_multinomial, jobs, processes))
+
+def resample_enrichment(observed, expected, replicates=10000, alpha=0.05,
+        seed=None, processes=1):
+    ''' get bootstrap confidence intervals and permutation p-values per bin
+    
+    Args:
+        observed: array of observed de novo counts per bin
+        expected: array of expected de novo counts per bin
+        replicates: number of bootstrap and permutation replicates
+        alpha: confidence intervals span the 1 - alpha range
+        seed: seed for the random number generator, for reproducible results
+        processes: number of processes to draw replicates across
+    
+    Returns:
+        pandas DataFrame with a row per bin, with the lower and upper bounds of
+        the observed/expected ratio, and a one-sided p-value for the observed
+        count being at least as high under the permutation null.
+    '''
+    observed = numpy.asarray(observed, dtype=float)
+    expected = numpy.asarray(expected, dtype=float)
+    
+    seeds = numpy.random.SeedSequence(seed).spawn(2)
+    boot = bootstrap_counts(observed, replicates, seeds[0], processes)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        ratios = boot / expected
+    lower, upper = numpy.percentile(ratios, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    
+    null = permute_counts(observed, expected, replicates, seeds[1], processes)
+    p_value = ((null >= observed).sum(axis=0) + 1) / (replicates + 1)
+    
+    return pandas.DataFrame({'lower': lower, 'upper': upper, 'p_value': p_value},
+        columns=['lower', 'upper', 'p_value'])
@@ -0,0 +1,195 @@
+
+from itertools import chain
+
+import numpy
+import pandas
+
+# a site key packs a SNV into one int64, as chromosome code (bits 36-40),
+# position (bits 4-35), ref allele (bits 2-3) and alt allele (bits 0-1)
+CHROM_SHIFT = 36
+POS_SHIFT = 4
+REF_SHIFT = 2
+REF_MASK = 0b1100
+
+ALLELES = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+CHROMS = { str(x): x for x in range(1, 23) }
+CHROMS.update({'X': 23, 'Y': 24, 'M': 25, 'MT': 25})
+
+def chrom_codes(chroms):
+    ''' convert chromosome names to integer codes (1-22, X=23, Y=24, MT=25)
+    
+    Unrecognised chromosomes are coded as -1.
+    '''
+    # code each distinct name once, which is quick for categorical columns
+    codes, names = pandas.factorize(chroms)
+    names = pandas.Series(numpy.asarray(names), dtype=str)
+    names = names.str.upper().str.replace('CHR', '', regex=False)
+    lookup = numpy.append(names.map(CHROMS).fillna(-1).astype(numpy.int64).values, -1)
+    
+    return lookup[codes]
+
+def allele_codes(alleles):
+    ''' convert single base alleles to 2-bit codes. Other alleles are -1.
+    '''
+    codes, names = pandas.factorize(alleles)
+    names = pandas.Series(numpy.asarray(names), dtype=str).str.upper()
+    lookup = numpy.append(names.map(ALLELES).fillna(-1).astype(numpy.int64).values, -1)
+    
+    return lookup[codes]
+
+def site_keys(chrom, pos, ref=None, alt=None):
+    ''' pack sites into int64 keys
+    
+    Args:
+        chrom: array of chromosome names
+        pos: array of positions
+        ref: array of reference alleles, or None to leave the ref bits empty
+        alt: array of alternate alleles, or None to leave the alt bits empty
+    
+    Returns:
+        numpy int64 array of keys. Sites which cannot be packed (unknown
+        chromosomes, or alleles which are not single bases) have keys of -1.
+    '''
+    
+    chrom = chrom_codes(chrom)
+    pos = numpy.asarray(pos, dtype=numpy.int64)
+    keys = (chrom << CHROM_SHIFT) | (pos << POS_SHIFT)
+    invalid = chrom < 0
+    
+    for alleles, shift in [(ref, REF_SHIFT), (alt, 0)]:
+        if alleles is not None:
+            codes = allele_codes(alleles)
+            keys |= numpy.where(codes < 0, 0, codes) << shift
+            invalid |= codes < 0
+    
+    keys[invalid] = -1
+    
+    return keys
+
+def drop_ref(keys):
+    ''' remove the ref allele from keys, to match sites by chrom, pos and alt
+    '''
+    keys = numpy.asarray(keys, dtype=numpy.int64)
+    
+    return numpy.where(keys < 0, keys, keys & ~REF_MASK)
+
+def position_keys(keys):
+    ''' remove both alleles from keys, to match sites by chrom and pos
+    '''
+    keys = numpy.asarray(keys, dtype=numpy.int64)
+    
+    return numpy.where(keys < 0, keys, keys >> POS_SHIFT << POS_SHIFT)
+
+def isin_keys(keys, other):
+    ''' vectorised membership test of one key array in another
+    '''
+    keys = numpy.asarray(keys, dtype=numpy.int64)
+    other = numpy.unique(numpy.asarray(other, dtype=numpy.int64))
+    other = other[other >= 0]
+    
+    return numpy.isin(keys, other, assume_unique=False) & (keys >= 0)
+
+def merge_on_keys(left, right, key='key'):
+    ''' left join two tables on int64 site keys, via a sorted-array lookup
+    
+    Args:
+        left: pandas DataFrame of sites, with a key column
+        right: pandas DataFrame of sites, with a key column. Only the first
+            row for each key is used.
+        key: name of the key column
+    
+    Returns:
+        copy of the left table, with the columns from the right table that
+        aren't already in the left table. Sites without a match in the right
+        table get missing values.
+    '''
+    
+    right = right.iloc[numpy.argsort(right[key].values, kind='mergesort')]
+    right_keys = right[key].values
+    left_keys = left[key].values
+    
+    # pad the right table with an empty row, which unmatched sites point to
+    right = pandas.concat([right, right.iloc[:0].reindex([None])], ignore_index=True)
+    
+    idx = numpy.searchsorted(right_keys, left_keys)
+    found = idx < len(right_keys)
+    found[found] = right_keys[idx[found]] == left_keys[found]
+    found &= left_keys >= 0
+    idx[~found] = len(right_keys)
+    
+    merged = left.copy()
+    for column in right.columns:
+        if column not in merged.columns:
+            merged[column] = right[column].values[idx]
+    
+    return merged
+
+def _check_order(keys, frontier):
+    ''' check that positions don't go back past the last position joined
+    '''
+    valid = keys[keys >= 0]
+    if len(valid) > 0 and position_keys(valid.min()) < frontier:
+        raise ValueError('sites must be sorted by chromosome (1-22, X, Y, MT) '
+            'and position, as in a site store')
+
+def merge_join(left_chunks, right_chunks, key='key'):
+    ''' left join two streams of site chunks, sorted by chromosome and position
+    
+    This gives the same rows as merge_on_keys, but only holds a chunk of each
+    table at once (plus the sites at the last position of the previous chunk),
+    so memory depends on the chunk size, rather than the size of the tables.
+    
+    Args:
+        left_chunks: iterable of DataFrames of sites, with a key column, in
+            the order of their keys (i.e. by chromosome code, then position)
+        right_chunks: iterable of DataFrames of sites, in the same order
+        key: name of the key column
+    
+    Yields:
+        joined DataFrames, as from merge_on_keys. All the sites at a position
+        are in the same chunk.
+    '''
+    
+    right_chunks = iter(right_chunks)
+    right, right_done = None, False
+    held, frontier = None, -1
+    
+    for chunk in chain(left_chunks, [None]):
+        if chunk is None:
+            if held is None:
+                break
+            left, held = held, None
+            limit = position_keys(left[key].values).max()
+        else:
+            _check_order(chunk[key].values, frontier)
+            left = chunk if held is None else pandas.concat([held, chunk], ignore_index=True)
+            
+            # hold back the last position, as it may continue in the next chunk
+            positions = position_keys(left[key].values)
+            limit = positions.max()
+            held = left[positions == limit]
+            left = left[positions < limit]
+            limit = positions[positions < limit].max() if len(left) > 0 else -1
+        
+        if len(left) == 0:
+            continue
+        
+        # read the right table until it is past the sites in this chunk
+        while not right_done and (right is None or len(right) == 0 or \
+                position_keys(right[key].values[-1]) <= limit):
+            extra = next(right_chunks, None)
+            if extra is None:
+                right_done = True
+                break
+            _check_order(extra[key].values, frontier)
+            extra = extra[extra[key].values >= 0]
+            right = extra if right is None else pandas.concat([right, extra], ignore_index=True)
+        
+        if right is None:
+            right = pandas.DataFrame({key: numpy.zeros(0, dtype=numpy.int64)})
+        
+        use = position_keys(right[key].values) <= limit
+        yield merge_on_keys(left, right[use], key)
+        
+        right = right[~use]
+        frontier = limit + 1
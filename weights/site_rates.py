@@ -0,0 +1,55 @@
+
+import os
+import pickle
+
+from denovonear.site_specific_rates import SiteRates
+
+from weights.cache import hash_key, cache_path, atomic_write
+from weights.instrument import PROFILER
+from weights.transcripts import transcript_state
+
+CQS = ['nonsense', 'missense', 'synonymous', 'splice_lof', 'splice_region']
+
+def _digest(tx):
+    ''' get a hex digest of a transcript's coordinates and sequences
+    '''
+    state = transcript_state(tx)
+    return hash_key(state['chrom'], state['strand'], state['exons'],
+        state['cds'], state['cds_sequence'], state['genomic_sequence'],
+        state['offset'])
+
+def get_site_rates(tx, mut_dict, masked_sites=None):
+    ''' get the sites and rates per consequence for a transcript, via a cache
+    
+    SiteRates output depends only on the transcript (its coordinates and
+    sequence), the masked transcript and the mutation rate table, so the
+    results are cached on disk under a hash of those inputs.
+    
+    Args:
+        tx: Transcript object for a gene
+        mut_dict: list of lists of sequence context changes and associated
+            mutation rates as [[initial, changed, rate], ...]
+        masked_sites: Transcript object for sites to exclude, or None
+    
+    Returns:
+        dictionary of lists of site dictionaries (with pos, offset, ref, alt
+        and prob keys), indexed by consequence type
+    '''
+    
+    masked = None
+    if masked_sites is not None:
+        masked = [ (x['start'], x['end']) for x in masked_sites.get_cds() ]
+    
+    key = hash_key(_digest(tx), masked, mut_dict)
+    path = cache_path('site_rates', key[:2], '{}.pkl'.format(key))
+    if os.path.exists(path):
+        PROFILER.count('site_rates.hits')
+        with open(path, 'rb') as handle:
+            return pickle.load(handle)
+    
+    PROFILER.count('site_rates.misses')
+    sites = SiteRates(tx, mut_dict, masked_sites=masked_sites)
+    rates = { cq: [ dict(x) for x in sites[cq] ] for cq in CQS }
+    atomic_write(path, pickle.dumps(rates, protocol=pickle.HIGHEST_PROTOCOL), mode='wb')
+    
+    return rates
@@ -0,0 +1,133 @@
+
+import json
+import os
+
+import numpy
+import pandas
+
+from weights.site_keys import CHROMS
+
+INDEX = 'index.json'
+
+def chrom_rank(chroms):
+    ''' get a numeric sort order for chromosome names (1-22, X, Y, MT, others)
+    '''
+    chroms = pandas.Series(chroms, dtype=str).str.replace('chr', '', regex=False)
+    
+    return chroms.map(CHROMS).fillna(26).astype(int).values
+
+def is_store(path):
+    ''' check if a path is a columnar site store, rather than a table
+    '''
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, INDEX))
+
+def write_store(data, path):
+    ''' write a table of sites to a memory-mappable columnar store
+    
+    The store is a folder, with a numpy file per column, and an index of the
+    rows for each chromosome. Rows are sorted by chromosome, position and alt
+    allele, so positions within each chromosome can be found by bisection.
+    String columns are stored as integer codes, with a list of categories.
+    
+    Args:
+        data: pandas DataFrame of sites, with chrom, pos and alt columns
+        path: path to folder to write the store to
+    '''
+    
+    data = data.assign(_rank=chrom_rank(data['chrom']))
+    data = data.sort_values(['_rank', 'chrom', 'pos', 'alt'], kind='mergesort')
+    del data['_rank']
+    data = data.reset_index(drop=True)
+    
+    if not os.path.exists(path):
+        os.makedirs(path)
+    
+    columns = []
+    for name in data.columns:
+        values = data[name]
+        categories = None
+        if values.dtype == object or str(values.dtype) in ['category', 'str', 'string']:
+            values = pandas.Categorical(values.astype(str))
+            categories = list(values.categories)
+            values = values.codes
+        
+        numpy.save(os.path.join(path, name + '.npy'), numpy.asarray(values))
+        columns.append({'name': name, 'categories': categories})
+    
+    chroms = {}
+    chrom = data['chrom'].astype(str)
+    for name in chrom.unique():
+        rows = numpy.where(chrom == name)[0]
+        chroms[name] = [int(rows[0]), int(rows[-1]) + 1]
+    
+    with open(os.path.join(path, INDEX), 'w') as handle:
+        json.dump({'rows': len(data), 'columns': columns, 'chroms': chroms},
+            handle, indent=2)
+
+def load_store(path, chrom=None, start=None, end=None, mmap=True):
+    ''' load sites from a columnar store
+    
+    Args:
+        path: path to store folder
+        chrom: chromosome to restrict to, or None for all sites
+        start: restrict to sites at or after this position (requires chrom)
+        end: restrict to sites at or before this position (requires chrom)
+        mmap: whether to memory-map the columns, rather than reading them
+    
+    Returns:
+        pandas DataFrame of sites. String columns are loaded as categoricals.
+        Memory-mapped columns are read-only, and shared with other processes
+        loading the same store.
+    '''
+    
+    index, columns = _open_store(path, mmap)
+    
+    first, last = 0, index['rows']
+    if chrom is not None:
+        first, last = index['chroms'].get(str(chrom), [0, 0])
+        pos = columns['pos'][first:last]
+        if end is not None:
+            last = first + numpy.searchsorted(pos, end, side='right')
+        if start is not None:
+            first = first + numpy.searchsorted(pos, start, side='left')
+    
+    return _read_rows(index, columns, first, last)
+
+def iter_store(path, chunksize=1000000):
+    ''' iterate through the sites in a columnar store, in chunks of rows
+    
+    Chunks come in the store's sort order (chromosome, position and alt), and
+    only the rows for the current chunk are read from the memory-mapped
+    columns.
+    '''
+    
+    index, columns = _open_store(path)
+    for first in range(0, index['rows'], chunksize):
+        yield _read_rows(index, columns, first, min(first + chunksize, index['rows']))
+
+def _open_store(path, mmap=True):
+    with open(os.path.join(path, INDEX)) as handle:
+        index = json.load(handle)
+    
+    mode = 'r' if mmap else None
+    columns = { x['name']: numpy.load(os.path.join(path, x['name'] + '.npy'),
+        mmap_mode=mode) for x in index['columns'] }
+    
+    return index, columns
+
+def _read_rows(index, columns, first, last):
+    ''' get a DataFrame for a range of rows from the store's columns
+    '''
+    data = {}
+    for column in index['columns']:
+        name = column['name']
+        values = columns[name][first:last]
+        if column['categories'] is not None:
+            # codes were checked on writing, and validating would copy them
+            values = pandas.Categorical.from_codes(values, column['categories'],
+                validate=False)
+        data[name] = values
+    
+    # don't copy, so numeric columns stay backed by the memory-mapped files
+    return pandas.DataFrame(data, columns=[ x['name'] for x in index['columns'] ],
+        copy=False)
@@ -0,0 +1,165 @@
+
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+from denovonear.ensembl_requester import EnsemblRequest
+from denovonear.load_gene import construct_gene_object, get_transcript_ids
+from denovonear.transcript import Transcript
+
+from weights.cache import cache_path, atomic_write, read_json, write_json
+from weights.instrument import PROFILER
+
+COMPLEMENT = str.maketrans('ACGTacgt', 'TGCAtgca')
+
+def transcript_state(tx):
+    ''' get the coordinates and sequences defining a Transcript
+    
+    Transcript is a Cython class which can't be pickled, so this gets plain
+    python values which can be, and which rebuild_transcript() converts back.
+    
+    Args:
+        tx: Transcript object (see denovonear)
+    
+    Returns:
+        dictionary of the transcript's name, chrom, start, end, strand, exon
+        and CDS ranges, CDS and genomic sequences, and genomic offset
+    '''
+    return {'name': tx.get_name(), 'chrom': tx.get_chrom(),
+        'start': tx.get_start(), 'end': tx.get_end(), 'strand': tx.get_strand(),
+        'exons': [ (x['start'], x['end']) for x in tx.get_exons() ],
+        'cds': [ (x['start'], x['end']) for x in tx.get_cds() ],
+        'cds_sequence': tx.get_cds_sequence(),
+        'genomic_sequence': tx.get_genomic_sequence(),
+        'offset': tx.get_genomic_offset()}
+
+def rebuild_transcript(state):
+    ''' make a Transcript object from the output of transcript_state()
+    '''
+    tx = Transcript(state['name'], state['chrom'], state['start'],
+        state['end'], state['strand'])
+    
+    if state['cds']:
+        tx.set_exons(state['exons'], state['cds'])
+        tx.set_cds(state['cds'])
+    
+    if state['cds_sequence']:
+        tx.add_cds_sequence(state['cds_sequence'])
+    
+    if state['genomic_sequence']:
+        # Transcript holds the genomic sequence for the + strand, but expects
+        # the sequence for the transcript's strand
+        seq = state['genomic_sequence']
+        if state['strand'] != '+':
+            seq = seq[::-1].translate(COMPLEMENT)
+        tx.add_genomic_sequence(seq, state['offset'])
+    
+    return tx
+
+class TranscriptStore(object):
+    ''' shared store of Transcript objects, keyed by build and transcript ID
+    
+    Built transcripts are held in memory up to a maximum count, evicting the
+    least recently used, and their states (see transcript_state()) are pickled
+    to a local cache folder, so later runs load them without contacting
+    Ensembl. The EnsemblRequest object is only created once something is
+    missing from the cache.
+    
+    The store can be shared between threads. Each thread gets its own
+    EnsemblRequest object, made by the requester function (EnsemblRequest by
+    default, or see weights.ensembl_fetch.ThrottledRequester).
+    '''
+    
+    def __init__(self, ensembl_dir, build='grch37', maxsize=1000, requester=None):
+        self.ensembl_dir = ensembl_dir
+        self.build = build
+        self.maxsize = maxsize
+        self.requester = requester if requester is not None else EnsemblRequest
+        self.memory = OrderedDict()
+        self.counts = {'memory': 0, 'disk': 0, 'ensembl': 0}
+        self.lock = threading.RLock()
+        self._local = threading.local()
+    
+    @property
+    def ensembl(self):
+        if getattr(self._local, 'ensembl', None) is None:
+            self._local.ensembl = self.requester(self.ensembl_dir, self.build)
+        return self._local.ensembl
+    
+    def _count(self, source, name):
+        with self.lock:
+            self.counts[source] += 1
+        PROFILER.count(name)
+    
+    def _path(self, tx_id):
+        return cache_path('transcripts', self.build, '{}.pkl'.format(tx_id))
+    
+    def _remember(self, tx_id, tx):
+        with self.lock:
+            self.memory[tx_id] = tx
+            self.memory.move_to_end(tx_id)
+            while len(self.memory) > self.maxsize:
+                self.memory.popitem(last=False)
+    
+    def get(self, tx_id):
+        ''' get a Transcript object for an Ensembl transcript ID
+        
+        Args:
+            tx_id: Ensembl transcript ID, without a version suffix
+        
+        Returns:
+            Transcript object (see denovonear)
+        '''
+        with self.lock:
+            if tx_id in self.memory:
+                self._count('memory', 'transcripts.memory_hits')
+                self.memory.move_to_end(tx_id)
+                return self.memory[tx_id]
+        
+        path = self._path(tx_id)
+        if os.path.exists(path):
+            self._count('disk', 'transcripts.disk_hits')
+            with open(path, 'rb') as handle:
+                tx = rebuild_transcript(pickle.load(handle))
+        else:
+            self._count('ensembl', 'transcripts.misses')
+            PROFILER.count('ensembl.transcripts')
+            tx = construct_gene_object(self.ensembl, tx_id)
+            state = transcript_state(tx)
+            atomic_write(path, pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), mode='wb')
+        
+        self._remember(tx_id, tx)
+        
+        return tx
+    
+    def transcript_ids(self, symbol):
+        ''' get the transcript IDs (and CDS lengths) for a gene, via the cache
+        '''
+        path = cache_path('transcripts', self.build, 'ids', '{}.json'.format(symbol))
+        ids = read_json(path)
+        if ids is None:
+            PROFILER.count('ensembl.transcript_ids')
+            ids = get_transcript_ids(self.ensembl, symbol)
+            write_json(path, ids)
+        
+        return ids
+
+_stores = {}
+
+def get_store(ensembl_dir, build='grch37', maxsize=1000, requester=None):
+    ''' get the shared TranscriptStore for an Ensembl cache folder and build
+    
+    A requester function replaces the store's requester, so later Ensembl
+    requests use it.
+    '''
+    key = (ensembl_dir, build)
+    if key not in _stores:
+        _stores[key] = TranscriptStore(ensembl_dir, build, maxsize)
+    
+    store = _stores[key]
+    if requester is not None and requester is not store.requester:
+        store.requester = requester
+        store._local = threading.local()
+    
+    return store